@@ -46,3 +46,6 @@ SLICK_REPORTING_FORM_MEDIA_DEFAULT = {
 
 SLICK_REPORTING_FORM_MEDIA = getattr(settings, 'SLICK_REPORTING_FORM_MEDIA', SLICK_REPORTING_FORM_MEDIA_DEFAULT)
 SLICK_REPORTING_DEFAULT_CHARTS_ENGINE = getattr(settings, 'SLICK_REPORTING_DEFAULT_CHARTS_ENGINE', 'highcharts')
+SLICK_REPORTING_USE_BALANCE_SNAPSHOTS = getattr(settings, 'SLICK_REPORTING_USE_BALANCE_SNAPSHOTS', False)
+SLICK_REPORTING_CACHE_ALIAS = getattr(settings, 'SLICK_REPORTING_CACHE_ALIAS', 'default')
+SLICK_REPORTING_CACHE_TRACKED_MODELS = getattr(settings, 'SLICK_REPORTING_CACHE_TRACKED_MODELS', [])
@@ -5,8 +5,13 @@ from django import apps
 class ReportAppConfig(apps.AppConfig):
     verbose_name = 'Slick Reporting'
     name = 'slick_reporting'
+    default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
         super().ready()
 
         from . import fields
+        from .app_settings import SLICK_REPORTING_CACHE_TRACKED_MODELS
+        from .cache import track_model
+        for label in SLICK_REPORTING_CACHE_TRACKED_MODELS:
+            track_model(apps.apps.get_model(label))
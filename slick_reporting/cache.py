@@ -0,0 +1,237 @@
+import datetime
+import decimal
+import hashlib
+import pickle
+import time
+import zlib
+from inspect import isclass
+from uuid import uuid4
+
+import simplejson as json
+from django.core.cache import caches
+from django.db.models import Model, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+
+from .app_settings import SLICK_REPORTING_CACHE_ALIAS
+
+KEY_PREFIX = 'slick_reporting'
+
+
+def _get_version_key(model):
+    return f'{KEY_PREFIX}:version:{model._meta.label_lower}'
+
+
+def bump_model_version(model, cache_alias=None):
+    """
+    Increment the version of the model, invalidating the cached results of the reports over it
+    """
+    cache = caches[cache_alias or SLICK_REPORTING_CACHE_ALIAS]
+    key = _get_version_key(model)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted in between
+        cache.set(key, 1, None)
+
+
+def get_models_versions(models, cache_alias=None):
+    """
+    :return: a dict of {model label: version}
+    """
+    keys = {_get_version_key(model): model._meta.label_lower for model in models}
+    versions = caches[cache_alias or SLICK_REPORTING_CACHE_ALIAS].get_many(list(keys))
+    return {label: versions.get(key, 0) for key, label in keys.items()}
+
+
+def _bump_sender_version(sender, **kwargs):
+    bump_model_version(sender)
+
+
+def track_model(model):
+    """
+    Bump the model version whenever one of its records is saved or deleted.
+    Updates made with `QuerySet.update` & the bulk methods send no signals, use `VersionedQuerySetMixin` for those.
+    """
+    dispatch_uid = f'slick_reporting_version_{model._meta.label_lower}'
+    post_save.connect(_bump_sender_version, sender=model, dispatch_uid=dispatch_uid)
+    post_delete.connect(_bump_sender_version, sender=model, dispatch_uid=dispatch_uid)
+
+
+class VersionedQuerySetMixin:
+    """
+    A QuerySet mixin bumping the model version on `update`, `bulk_create` and `bulk_update`
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bump_model_version(self.model)
+        return rows
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        bump_model_version(self.model)
+        return objs
+
+    def bulk_update(self, *args, **kwargs):
+        rows = super().bulk_update(*args, **kwargs)
+        bump_model_version(self.model)
+        return rows
+
+
+class VersionedQuerySet(VersionedQuerySetMixin, QuerySet):
+    pass
+
+
+def normalize_parameter(value):
+    """
+    Normalize a report parameter (a form cleaned value, a column, ..) to a json serializable value, stable between
+    requests.
+    """
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, QuerySet):
+        return sorted(str(x) for x in value.values_list('pk', flat=True))
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, Promise)):
+        return force_str(value)
+    if isclass(value):
+        return getattr(value, 'name', '') or f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, dict):
+        return {str(k): normalize_parameter(v) for k, v in value.items()}
+    if isinstance(value, (set, frozenset)):
+        return sorted(str(normalize_parameter(x)) for x in value)
+    if isinstance(value, (list, tuple)):
+        return [normalize_parameter(x) for x in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return force_str(value)
+
+
+class ReportResultCache:
+    """
+    Caches the report results using Django's cache framework, the results are pickled and compressed.
+    The versions of the models the report is computed from are part of the key, so the results are invalidated once
+    any of them change.
+    Identical computations running at the same time are done once: the first computes the results, the others wait
+    for them to be cached.
+    Counts the hits & misses per report.
+    """
+    key_prefix = KEY_PREFIX
+
+    lock_timeout = 300
+    """Seconds after which the lock of a computation expires, in case the process computing died"""
+
+    wait_timeout = 60
+    """Seconds to wait for the results computed by another request, before computing them locally"""
+
+    poll_interval = 0.1
+    """Seconds between each check for the results computed by another request"""
+
+    def __init__(self, cache_alias=None, timeout=None, models=None):
+        """
+        :param cache_alias: the Django cache to use, defaults to `SLICK_REPORTING_CACHE_ALIAS`
+        :param timeout: the results time to live, in seconds
+        :param models: the models the results are computed from, see `track_model`
+        """
+        self.cache_alias = cache_alias or SLICK_REPORTING_CACHE_ALIAS
+        self.timeout = timeout
+        self.models = models or []
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, report_slug, parameters):
+        """
+        Get the cache key of a report results
+        :param report_slug:
+        :param parameters: a dict of the parameters the results depends on
+        :return: the key
+        """
+        parameters = dict(parameters, models_versions=get_models_versions(self.models, self.cache_alias))
+        parameters = json.dumps(normalize_parameter(parameters), sort_keys=True)
+        return f'{self.key_prefix}:results:{report_slug}:{hashlib.md5(parameters.encode()).hexdigest()}'
+
+    def get(self, report_slug, key):
+        """
+        Get the cached results, counting the hit or miss
+        :return: the results or None
+        """
+        payload = self.cache.get(key)
+        self._count(report_slug, 'misses' if payload is None else 'hits')
+        return self._load(payload)
+
+    @staticmethod
+    def _load(payload):
+        if payload is None:
+            return None
+        return pickle.loads(zlib.decompress(payload))
+
+    def set(self, key, results):
+        self.cache.set(key, zlib.compress(pickle.dumps(results, pickle.HIGHEST_PROTOCOL)), self.timeout)
+
+    def get_or_compute(self, report_slug, parameters, compute):
+        """
+        Get the cached results of the report, or compute and cache them
+        :param report_slug:
+        :param parameters: a dict of the parameters the results depends on
+        :param compute: a callable returning the results
+        :return: the results
+        """
+        key = self.get_key(report_slug, parameters)
+        results = self.get(report_slug, key)
+        if results is None:
+            results = self._compute_once(key, compute)
+        return results
+
+    def _compute_once(self, key, compute):
+        """
+        Compute the results once across the processes, using a lock held in the cache: the request getting the lock
+        computes and caches the results, the others wait for them, and compute them locally if they are not there
+        after `wait_timeout` (or if the lock is released without them).
+        """
+        lock_key = f'{key}:lock'
+        token = uuid4().hex
+        if self.cache.add(lock_key, token, self.lock_timeout):
+            try:
+                results = compute()
+                self.set(key, results)
+            finally:
+                if self.cache.get(lock_key) == token:
+                    self.cache.delete(lock_key)
+            return results
+
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            results = self._load(self.cache.get(key))
+            if results is not None:
+                return results
+            if self.cache.get(lock_key) is None:
+                break
+
+        results = compute()
+        self.set(key, results)
+        return results
+
+    def _get_stats_key(self, report_slug, name):
+        return f'{self.key_prefix}:stats:{report_slug}:{name}'
+
+    def _count(self, report_slug, name):
+        key = self._get_stats_key(report_slug, name)
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            # evicted in between
+            self.cache.set(key, 1, None)
+
+    def get_stats(self, report_slug):
+        """
+        :return: a dict of the hits & misses count of the report
+        """
+        return {name: self.cache.get(self._get_stats_key(report_slug, name), 0) for name in ('hits', 'misses')}
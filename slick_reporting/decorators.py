@@ -21,3 +21,21 @@ def report_field_register(report_field, *args, **kwargs):
 
     _model_admin_wrapper(report_field)
     return report_field
+
+
+def rollup_register(rollup_class):
+    """
+    Registers the wrapped Rollup class into the rollup registry:
+
+    @rollup_register
+    class DailySales(Rollup):
+        report_model = SimpleSales
+        date_field = 'doc_date'
+        dimensions = ['client']
+        measures = ['value']
+    """
+    from .rollups import Rollup, rollup_registry
+
+    if not issubclass(rollup_class, Rollup):
+        raise ValueError('Wrapped class must subclass Rollup.')
+    return rollup_registry.register(rollup_class)
@@ -1,13 +1,62 @@
+import threading
 import uuid
 
-from django.db.models import Sum
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Case, Count, ExpressionWrapper, F, IntegerField, Q, QuerySet, Sum, Value, When, Window
+from django.db.models.functions import Coalesce
 from django.template.defaultfilters import date as date_filter
 from django.utils.translation import gettext_lazy as _
 
-from .helpers import get_calculation_annotation
+from . import app_settings
+from .helpers import get_calculation_annotation, get_filters_signature, get_field_from_query_text, get_prefixed_q
 from .registry import field_registry
 
 
+class ComputationCache(object):
+    """
+    Holds the computation fields prepared during a report run, keyed by their computation key,
+    so that a field (or a dependency) with the same class and filters is prepared only once.
+    Safe to share between the threads preparing the fields concurrently.
+    """
+
+    def __init__(self):
+        self._fields = {}
+        self._lock = threading.Lock()
+        self._keys_locks = {}
+
+    def get(self, key):
+        return self._fields.get(key)
+
+    def add(self, key, report_field):
+        """
+        Add a report field to the cache, if the key is already there the existing field is kept.
+        :return: the report field held by the cache for this key
+        """
+        return self._fields.setdefault(key, report_field)
+
+    def get_or_prepare(self, key, prepare):
+        """
+        Get the report field cached by `key`, or call `prepare` to get it prepared and cache it.
+        :param key: the computation key
+        :param prepare: a callable returning a prepared report field
+        :return: the report field
+        """
+        report_field = self._fields.get(key)
+        if report_field is not None:
+            return report_field
+        with self._lock:
+            key_lock = self._keys_locks.setdefault(key, threading.Lock())
+        # Another thread may be preparing the same key, wait for it instead of preparing it again
+        with key_lock:
+            report_field = self._fields.get(key)
+            if report_field is None:
+                report_field = self.add(key, prepare())
+        return report_field
+
+    def __len__(self):
+        return len(self._fields)
+
+
 class SlickReportField(object):
     """
     Computation field responsible for making the calculation unit
@@ -52,6 +101,24 @@ class SlickReportField(object):
     prevent_group_by = False
     """Will prevent group by calculation for this specific field, serves when you want to compute overall results"""
 
+    group_keys_filters = None
+    """The kwargs filters restricting the field to some group by keys (ie: a report page), set by the generator.
+    They are left out of the requirements preventing the group by."""
+
+    rollup_states = None
+    """A dict of the `RollupState` by rollup name shared by the generator, so the states are loaded once per report"""
+
+    computation_cache = None
+    """A `ComputationCache` shared by the generator, if set, the dependencies are looked up there before being
+    prepared"""
+
+    single_query_debit_credit = False
+    """If True, and both plus_side_q and minus_side_q are set, the debit and the credit are computed in one query
+    using filtered aggregates (ie: `Sum('value', filter=plus_q)`) instead of two separate queries"""
+
+    use_rollups = True
+    """If True, the calculation is computed from a registered `Rollup` when one can answer it, see `get_rollup`"""
+
     @classmethod
     def create(cls, method, field, name=None, verbose_name=None, is_summable=True):
         """
@@ -92,6 +159,9 @@ class SlickReportField(object):
         self.requires = self.requires or []
         self.group_by = self.group_by or group_by
         self._cache = None, None, None
+        self._indexed_cache = None
+        # a dependency shared by the fields prepared in several threads is evaluated by one of them
+        self._evaluation_lock = threading.Lock()
         self._require_classes = self._get_required_classes()
 
         if not self.plus_side_q and not self.minus_side_q:
@@ -116,6 +186,67 @@ class SlickReportField(object):
             queryset = queryset.aggregate(annotation)
         return queryset
 
+    def get_conditional_aggregates(self, alias_prefix='', q_filter=None, relation=''):
+        """
+        Get the debit and credit aggregates filtered by their respective side Q.
+        :param alias_prefix: a prefix for the aggregates aliases, useful when combined with other aggregates
+        :param q_filter: an extra Q to filter both aggregates with
+        :param relation: the relation path to the report_model, to aggregate it from a related model
+        :return: a dict of {alias: aggregate}
+        """
+        annotation = self.get_annotation_name()
+        calculation_field = f'{relation}__{self.calculation_field}' if relation else self.calculation_field
+
+        def get_filter(side_q):
+            side_q = [get_prefixed_q(x, relation) if relation else x for x in side_q or []]
+            filters = [x for x in [q_filter] + side_q if x]
+            return Q(*filters) if filters else None
+
+        aggregates = {
+            f'{alias_prefix}{annotation}__debit': self.calculation_method(
+                calculation_field, filter=get_filter(self.plus_side_q))
+        }
+        if self._debit_and_credit:
+            aggregates[f'{alias_prefix}{annotation}__credit'] = self.calculation_method(
+                calculation_field, filter=get_filter(self.minus_side_q))
+        return aggregates
+
+    def split_conditional_results(self, results, group_by='', alias_prefix=''):
+        """
+        Split the results of `get_conditional_aggregates` back to the debit and credit results,
+        in the same shape `apply_aggregation` returns them.
+        :param results: the evaluated aggregate dict or the list of grouped rows
+        :param group_by: the group by field name, if any
+        :param alias_prefix: the prefix used with `get_conditional_aggregates`
+        :return: a tuple of (debit_results, credit_results)
+        """
+        annotation = self.get_annotation_name()
+        debit_alias = f'{alias_prefix}{annotation}__debit'
+        credit_alias = f'{alias_prefix}{annotation}__credit'
+
+        if not group_by:
+            debit_results = {annotation: results[debit_alias]}
+            credit_results = {annotation: results[credit_alias]} if self._debit_and_credit else None
+            return debit_results, credit_results
+
+        debit_results = []
+        credit_results = [] if self._debit_and_credit else None
+        for row in results:
+            # Rows where the side filter matched nothing are left out, as they would be from a side specific query
+            if row[debit_alias] is not None:
+                debit_results.append({group_by: row[group_by], annotation: row[debit_alias]})
+            if self._debit_and_credit and row[credit_alias] is not None:
+                credit_results.append({group_by: row[group_by], annotation: row[credit_alias]})
+        return debit_results, credit_results
+
+    def apply_conditional_aggregation(self, queryset, group_by=''):
+        aggregates = self.get_conditional_aggregates()
+        if group_by:
+            results = queryset.values(group_by).annotate(**aggregates)
+        else:
+            results = queryset.aggregate(**aggregates)
+        return self.split_conditional_results(results, group_by)
+
     def init_preparation(self, q_filters=None, kwargs_filters=None, **kwargs):
         """
         Called by the generator to preparet he calculation of this field + it's requirements
@@ -131,6 +262,123 @@ class SlickReportField(object):
         debit_results, credit_results = self.prepare(q_filters, kwargs_filters, **kwargs)
         self._cache = debit_results, credit_results, dep_values
 
+    def set_prepared_results(self, debit_results, credit_results, q_filters=None, kwargs_filters=None):
+        """
+        Called by the generator when the results of this field were computed along with other fields,
+        the requirements are prepared as usual.
+        :param debit_results: debit results in the same shape `prepare` returns them
+        :param credit_results: credit results in the same shape `prepare` returns them
+        :param q_filters:
+        :param kwargs_filters:
+        :return:
+        """
+        kwargs_filters = kwargs_filters or {}
+        dep_values = self._prepare_dependencies(q_filters, kwargs_filters.copy())
+        self._cache = debit_results, credit_results, dep_values
+
+    def update_prepared_results(self, debit_results, credit_results):
+        """
+        Called by the generator to replace the prepared results by the ones read along the report records,
+        the requirements are kept.
+        :param debit_results: debit results in the same shape `prepare` returns them
+        :param credit_results: credit results in the same shape `prepare` returns them
+        """
+        self._cache = debit_results, credit_results, self._cache[2]
+
+    def evaluate_results(self):
+        """
+        Evaluate the prepared results (and the requirements ones) which are lazy querysets, so no query is issued
+        while resolving. Called by the generator when the field is prepared in another thread.
+        :return:
+        """
+        with self._evaluation_lock:
+            debit_results, credit_results, dep_values = self._cache
+            for results in (debit_results, credit_results):
+                if isinstance(results, QuerySet):
+                    len(results)
+        for dep in (dep_values or {}).values():
+            dep['instance'].evaluate_results()
+
+    def prepare_filters(self, q_filters=None, kwargs_filters=None):
+        """
+        Hook to alter the filters before they're applied on the queryset in `prepare`
+        :param q_filters:
+        :param kwargs_filters:
+        :return: a tuple of (q_filters, kwargs_filters)
+        """
+        return q_filters, kwargs_filters
+
+    def can_fuse(self):
+        """
+        Check if this field calculation can be computed in the same query with other fields.
+        Only fields which uses the default query flow can, the ones customizing it are computed on their own.
+        :return: bool
+        """
+        return type(self).prepare is SlickReportField.prepare and self.has_default_preparation() and \
+            self.has_default_aggregation()
+
+    def has_default_preparation(self):
+        """
+        Check if this field prepares its calculation and its dependencies using the default methods
+        :return: bool
+        """
+        klass = type(self)
+        return all(getattr(klass, method) is getattr(SlickReportField, method) for method in [
+            'init_preparation', '_prepare_dependencies'])
+
+    def has_default_aggregation(self):
+        """
+        Check if this field aggregates the report_model using the default methods
+        :return: bool
+        """
+        klass = type(self)
+        return all(getattr(klass, method) is getattr(SlickReportField, method) for method in [
+            'apply_aggregation', 'apply_q_plus_filter', 'apply_q_minus_filter', 'get_queryset',
+            'get_annotation_name'])
+
+    def get_fusion_key(self, q_filters=None, kwargs_filters=None):
+        """
+        Get a key identifying the query this field would run, fields with the same key can be computed
+        in one query.
+        :param q_filters:
+        :param kwargs_filters:
+        :return: a hashable key, or None if the field can not be computed along with others.
+        """
+        if not self.can_fuse():
+            return None
+        q_filters, kwargs_filters = self.prepare_filters(q_filters, kwargs_filters)
+        return self.get_query_key(q_filters, kwargs_filters)
+
+    def get_rollup(self, q_filters=None, kwargs_filters=None, prepared=False):
+        """
+        Get the registered rollup this field calculation, with the given filters, can be computed from
+        :param q_filters:
+        :param kwargs_filters:
+        :param prepared: if True, the filters are already passed through `prepare_filters`
+        :return: a `Rollup` instance or None
+        """
+        if not self.use_rollups:
+            return None
+        from .rollups import rollup_registry
+        if not prepared:
+            q_filters, kwargs_filters = self.prepare_filters(q_filters, kwargs_filters)
+        return rollup_registry.get_rollup(self, q_filters, kwargs_filters)
+
+    def get_query_key(self, q_filters=None, kwargs_filters=None):
+        """
+        Get a key identifying the aggregate query on the report_model using exactly the given filters
+        :param q_filters:
+        :param kwargs_filters:
+        :return: a hashable key
+        """
+        group_by = '' if self.prevent_group_by else self.group_by
+        # aggregates traversing different relations would multiply each other rows if joined in one query
+        relation_path = self.calculation_field.rpartition('__')[0]
+        return (self.report_model, group_by, relation_path,
+                get_filters_signature(self.base_q_filters, self.base_kwargs_filters),
+                get_filters_signature(q_filters, kwargs_filters),
+                get_filters_signature(self.plus_side_q), get_filters_signature(self.minus_side_q))
+
     def prepare(self, q_filters=None, kwargs_filters=None, **kwargs):
         """
         This is the first hook where you can customize the calculation away from the Django Query aggregation method
@@ -143,6 +391,13 @@ class SlickReportField(object):
         :param kwargs:
         :return:
         """
+        q_filters, kwargs_filters = self.prepare_filters(q_filters, kwargs_filters)
+        rollup = self.get_rollup(q_filters, kwargs_filters, prepared=True)
+        if rollup:
+            results = rollup.get_results(self, kwargs_filters)
+            if results is not None:
+                return results
+
         queryset = self.get_queryset()
         group_by = '' if self.prevent_group_by else self.group_by
         if q_filters:
@@ -150,6 +405,9 @@ class SlickReportField(object):
         if kwargs_filters:
             queryset = queryset.filter(**kwargs_filters)
 
+        if self._debit_and_credit and self.single_query_debit_credit:
+            return self.apply_conditional_aggregation(queryset, group_by)
+
         if self.plus_side_q:
             queryset = self.apply_q_plus_filter(queryset)
         debit_results = self.apply_aggregation(queryset, group_by)
@@ -183,15 +441,47 @@ class SlickReportField(object):
         """
         return get_calculation_annotation(self.calculation_field, self.calculation_method)
 
+    def get_computation_key(self, q_filters=None, kwargs_filters=None):
+        """
+        Get a key identifying this field computation with the given filters,
+        two fields having the same key would compute the exact same results.
+        :param q_filters:
+        :param kwargs_filters:
+        :return: a hashable key
+        """
+        return (type(self), self.report_model, self.group_by, self.date_field,
+                get_filters_signature(q_filters, kwargs_filters),
+                get_filters_signature(self.plus_side_q), get_filters_signature(self.minus_side_q))
+
     def _prepare_dependencies(self, q_filters=None, extra_filters=None, ):
         values = {}
         for dep_class in self._require_classes:
             dep = dep_class(self.plus_side_q, self.minus_side_q, self.report_model,
                             date_field=self.date_field, group_by=self.group_by)
-            values[dep.name] = {'results': dep.init_preparation(q_filters, extra_filters),
+            dep.computation_cache = self.computation_cache
+            dep.group_keys_filters = self.group_keys_filters
+            dep.rollup_states = self.rollup_states
+            dep_filters = extra_filters
+            if dep.prevent_group_by and self.group_keys_filters:
+                dep_filters = {k: v for k, v in (extra_filters or {}).items() if k not in self.group_keys_filters}
+            if self.computation_cache is None:
+                dep.init_preparation(q_filters, dep_filters)
+            else:
+                key = dep.get_computation_key(q_filters, dep_filters)
+                dep = self.computation_cache.get_or_prepare(key, self._get_dependency_preparer(
+                    dep, q_filters, dep_filters))
+            values[dep.name] = {'results': None,
                                 'instance': dep}
         return values
 
+    @staticmethod
+    def _get_dependency_preparer(dep, q_filters, extra_filters):
+        def prepare():
+            dep.init_preparation(q_filters, extra_filters)
+            return dep
+
+        return prepare
+
     def resolve(self, current_obj, current_row=None):
         '''
         Reponsible for getting the exact data from the prepared value
@@ -231,41 +521,53 @@ class SlickReportField(object):
             dep_results[d] = d_instance.resolve(current_obj)
         return dep_results
 
+    def _index_results(self, results, group_by):
+        """
+        Index the prepared results by the group by value, so they can be looked up directly while resolving
+        :param results: the results as returned by `prepare`
+        :param group_by: the group by field name
+        :return: a dict of {str(group_by value): calculated value}
+        """
+        annotation = self.get_annotation_name()
+        index = {}
+        for x in results:
+            index.setdefault(str(x[group_by]), x[annotation])
+        return index
+
+    def _get_indexed_data(self, cached):
+        """
+        Get the debit and credit results indexed by the group by value.
+        The index is built once per prepared results, and re-built only if the cached results changes.
+        :param cached: the cached prepared results
+        :return: a tuple of (debit_index, credit_index)
+        """
+        if self._indexed_cache is None or self._indexed_cache[0] is not cached:
+            group_by = '' if self.prevent_group_by else self.group_by
+            cached_debit, cached_credit, dependencies_value = cached
+            debit_index = self._index_results(cached_debit, group_by) if cached_debit else {}
+            credit_index = self._index_results(cached_credit, group_by) if cached_credit else {}
+            self._indexed_cache = cached, debit_index, credit_index
+        return self._indexed_cache[1], self._indexed_cache[2]
+
     def extract_data(self, cached, current_obj):
         group_by = '' if self.prevent_group_by else self.group_by
         debit_value = 0
         credit_value = 0
-        annotation = self.get_annotation_name()
 
         cached_debit, cached_credit, dependencies_value = cached
 
         if cached_debit or cached_credit:
-            debit = None
-            if cached_debit is not None:
-                if not group_by:
+            if not group_by:
+                if cached_debit is not None:
                     x = list(cached_debit.keys())[0]
                     debit_value = cached_debit[x]
-                else:
-                    for i, x in enumerate(cached_debit):
-                        if str(x[group_by]) == current_obj:
-                            debit = cached_debit[i]
-                            break
-                    if debit:
-                        debit_value = debit[annotation]
-
-            if cached_credit is not None:
-                credit = None
                 if cached_credit is not None:
-                    if not group_by:
-                        x = list(cached_credit.keys())[0]
-                        credit_value = cached_credit[x]
-                    else:
-                        for i, x in enumerate(cached_credit):
-                            if str(x[group_by]) == current_obj:
-                                credit = cached_credit[i]
-                                break
-                        if credit:
-                            credit_value = credit[annotation]
+                    x = list(cached_credit.keys())[0]
+                    credit_value = cached_credit[x]
+            else:
+                debit_index, credit_index = self._get_indexed_data(cached)
+                debit_value = debit_index.get(current_obj, debit_value)
+                credit_value = credit_index.get(current_obj, credit_value)
         return debit_value, credit_value
 
     def final_calculation(self, debit, credit, dep_dict):
@@ -273,6 +575,60 @@ class SlickReportField(object):
         credit = credit or 0
         return debit - credit
 
+    def get_aggregate_expression(self):
+        """
+        Hook to get an aggregate expression computing this field value, as `resolve` returns it, for a group by value.
+        Used to order the report by this field in SQL.
+        :return: an expression, or None if the field value can not be computed by an aggregate
+        """
+        klass = type(self)
+        if not (self.can_fuse() and klass.prepare_filters is SlickReportField.prepare_filters and
+                klass.final_calculation is SlickReportField.final_calculation):
+            return None
+        debit, credit = self.get_side_aggregates()
+        return debit if credit is None else debit - credit
+
+    def get_side_aggregates(self):
+        """
+        Get the debit and credit aggregates, defaulting to 0 when there are no records
+        :return: a tuple of (debit aggregate, credit aggregate or None if the field has no sides)
+        """
+        output_field = self.get_aggregate_output_field()
+        aggregates = [Coalesce(x, Value(0), output_field=output_field)
+                      for x in self.get_conditional_aggregates().values()]
+        return aggregates[0], aggregates[1] if len(aggregates) > 1 else None
+
+    def get_aggregate_output_field(self):
+        """
+        Get the model field type of this field aggregates
+        """
+        if issubclass(self.calculation_method, Count):
+            return IntegerField()
+        return get_field_from_query_text(self.calculation_field, self.report_model)
+
+    def get_window_expression(self):
+        """
+        Hook for fields computed on each record of a detail report (a report without group_by) using a window
+        function, the generator annotates the records with the returned expression.
+        :return: an expression, or None if the field is not computed this way
+        """
+        return None
+
+    def get_signed_expression(self):
+        """
+        Get an expression of the `calculation_field` signed by its side, ie positive on the plus side and negative
+        on the minus side.
+        """
+        output_field = get_field_from_query_text(self.calculation_field, self.report_model)
+        value = F(self.calculation_field)
+        if not self._debit_and_credit:
+            return value
+        debit = Case(When(Q(*self.plus_side_q), then=value), default=Value(0),
+                     output_field=output_field) if self.plus_side_q else value
+        credit = Case(When(Q(*self.minus_side_q), then=value), default=Value(0),
+                      output_field=output_field) if self.minus_side_q else value
+        return ExpressionWrapper(debit - credit, output_field=output_field)
+
     @classmethod
     def get_full_dependency_list(cls):
         """
@@ -335,13 +691,29 @@ class FirstBalanceField(SlickReportField):
     name = '__fb__'
     verbose_name = _('first balance')
 
-    def prepare(self, q_filters=None, extra_filters=None, **kwargs):
-        extra_filters = extra_filters or {}
+    use_snapshots = app_settings.SLICK_REPORTING_USE_BALANCE_SNAPSHOTS
+    """If True, the balance is computed starting from the nearest stored `BalanceSnapshot` (if any) instead of from
+    the beginning of time. Snapshots are built via the `build_balance_snapshots` management command."""
+
+    def can_fuse(self):
+        # `prepare` is overridden only to start from the snapshots
+        return not self.use_snapshots and type(self).prepare is FirstBalanceField.prepare and \
+            self.has_default_preparation() and self.has_default_aggregation()
 
-        from_date_value = extra_filters.get(f'{self.date_field}__gte')
-        extra_filters.pop(f'{self.date_field}__gte', None)
-        extra_filters[f'{self.date_field}__lt'] = from_date_value
-        return super(FirstBalanceField, self).prepare(q_filters, extra_filters)
+    def prepare(self, q_filters=None, kwargs_filters=None, **kwargs):
+        if self.use_snapshots:
+            from .snapshots import get_snapshot_results
+            results = get_snapshot_results(self, q_filters, kwargs_filters)
+            if results is not None:
+                return results
+        return super(FirstBalanceField, self).prepare(q_filters, kwargs_filters, **kwargs)
+
+    def prepare_filters(self, q_filters=None, kwargs_filters=None):
+        kwargs_filters = dict(kwargs_filters or {})
+
+        from_date_value = kwargs_filters.pop(f'{self.date_field}__gte', None)
+        kwargs_filters[f'{self.date_field}__lt'] = from_date_value
+        return q_filters, kwargs_filters
 
 
 field_registry.register(FirstBalanceField)
@@ -385,6 +757,47 @@ class PercentageToBalance(SlickReportField):
         return (obj_balance/total) * 100
 
 
+class RunningBalanceOpeningField(FirstBalanceField):
+    """
+    The balance up to and including the start date, the records of a detail report being those after it
+    """
+    name = '__running_balance_opening__'
+
+    def prepare_filters(self, q_filters=None, kwargs_filters=None):
+        q_filters, kwargs_filters = super(RunningBalanceOpeningField, self).prepare_filters(q_filters, kwargs_filters)
+        kwargs_filters[f'{self.date_field}__lte'] = kwargs_filters.pop(f'{self.date_field}__lt')
+        return q_filters, kwargs_filters
+
+
+class RunningBalanceReportField(SlickReportField):
+    """
+    The balance after each record, meant for detail reports (without group_by) like a client statement.
+    Computed by the database using a window function over the records ordered by the date field,
+    starting from the balance up to the start date.
+    """
+    name = '__running_balance__'
+    verbose_name = _('Running Balance')
+    requires = [RunningBalanceOpeningField]
+    is_summable = False
+
+    def prepare(self, q_filters=None, kwargs_filters=None, **kwargs):
+        if self.group_by:
+            raise ImproperlyConfigured(f'{self.name} is computed on the records of a detail report, '
+                                       f'it can not be grouped by')
+        # Nothing to prepare other than the opening balance, the computation is done on the report records
+        return None, None
+
+    def get_window_expression(self):
+        output_field = get_field_from_query_text(self.calculation_field, self.report_model)
+        first_balance = self.get_dependency_value(None, RunningBalanceOpeningField.name) or 0
+        running_total = Window(self.calculation_method(self.get_signed_expression()),
+                               order_by=[F(self.date_field).asc(), F('pk').asc()])
+        return ExpressionWrapper(running_total + Value(first_balance), output_field=output_field)
+
+
+field_registry.register(RunningBalanceReportField)
+
+
 class CreditReportField(SlickReportField):
     name = '__credit__'
     verbose_name = _('Credit')
@@ -392,6 +805,9 @@ class CreditReportField(SlickReportField):
     def final_calculation(self, debit, credit, dep_dict):
         return credit
 
+    def get_aggregate_expression(self):
+        return self.get_side_aggregates()[1] if self.can_fuse() else None
+
 
 field_registry.register(CreditReportField)
 
@@ -403,6 +819,9 @@ class DebitReportField(SlickReportField):
     def final_calculation(self, debit, credit, dep_dict):
         return debit
 
+    def get_aggregate_expression(self):
+        return self.get_side_aggregates()[0] if self.can_fuse() else None
+
 
 field_registry.register(DebitReportField)
 
@@ -1,11 +1,14 @@
 from collections import OrderedDict
 
 from django import forms
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
 from . import app_settings
+from .forms import LazyModelMultipleChoiceField
 from .helpers import get_foreign_keys
+from .registry import lookup_registry
 
 
 class BaseReportForm:
@@ -96,8 +99,21 @@ def _default_foreign_key_widget(f_field):
     return {'form_class': forms.ModelMultipleChoiceField, 'required': False, }
 
 
+def lazy_foreign_key_widget(f_field):
+    """
+    A `foreign_key_widget_func` rendering the foreign key with a `LazyModelMultipleChoiceField`, the foreign key must
+    be registered in `lookup_registry` to be looked up by `ForeignKeyLookupView`
+    """
+    if not lookup_registry.is_registered(f_field):
+        raise ImproperlyConfigured(f'{lookup_registry.get_key(f_field)} is rendered lazily but not registered in '
+                                   f'slick_reporting.registry.lookup_registry, the lookup would not find its records')
+    return {'form_class': LazyModelMultipleChoiceField, 'required': False,
+            'lookup_key': lookup_registry.get_key(f_field)}
+
+
 def report_form_factory(model, crosstab_model=None, display_compute_reminder=True, fkeys_filter_func=None,
-                        foreign_key_widget_func=None, excluded_fields=None, initial=None, required=None):
+                        foreign_key_widget_func=None, excluded_fields=None, initial=None, required=None,
+                        lazy_foreign_keys=None):
     """
     Create a Report Form based on the report_model passed by
     1. adding a start_date and end_date fields
@@ -112,6 +128,7 @@ def report_form_factory(model, crosstab_model=None, display_compute_reminder=Tru
     :param excluded_fields: a list of fields to be excluded from the report form
     :param initial a dict for fields initial
     :param required a list of fields that should be marked as required
+    :param lazy_foreign_keys: a list of foreign keys to render with `lazy_foreign_key_widget`, or True for all of them
     :return:
     """
     foreign_key_widget_func = foreign_key_widget_func or _default_foreign_key_widget
@@ -142,7 +159,10 @@ def report_form_factory(model, crosstab_model=None, display_compute_reminder=Tru
 
     for name, f_field in fkeys_map.items():
         fkeys_list.append(name)
-        field_attrs = foreign_key_widget_func(f_field)
+        if lazy_foreign_keys is True or name in (lazy_foreign_keys or []) or f_field.name in (lazy_foreign_keys or []):
+            field_attrs = lazy_foreign_key_widget(f_field)
+        else:
+            field_attrs = foreign_key_widget_func(f_field)
         if name in required:
             field_attrs['required'] = True
         fields[name] = f_field.formfield(**field_attrs)
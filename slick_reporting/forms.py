@@ -1,6 +1,8 @@
 from __future__ import unicode_literals
 
 from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse
 
 
 class OrderByForm(forms.Form):
@@ -32,3 +34,48 @@ class OrderByForm(forms.Form):
                 asc = False
             return order_field, not asc
         return None, None
+
+
+class LazySelectMultiple(forms.SelectMultiple):
+    """
+    A select rendering only its selected options, the others are fetched as the user types from the paginated
+    `ForeignKeyLookupView`, using the select2 ajax data attributes.
+    """
+    lookup_key = None
+    lookup_url_name = 'slick_reporting_lookup'
+
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs)
+        if self.lookup_key:
+            attrs.setdefault('data-ajax--url', reverse(self.lookup_url_name, args=[self.lookup_key]))
+            attrs.setdefault('data-ajax--delay', 250)
+        return attrs
+
+    def optgroups(self, name, value, attrs=None):
+        choices = self.choices
+        selected = [x for x in value if x]
+        queryset = choices.queryset.none()
+        if selected:
+            try:
+                queryset = choices.queryset.filter(**{f'{choices.field.to_field_name or "pk"}__in': selected})
+                # validate the values now, as the options are rendered
+                len(queryset)
+            except (ValueError, TypeError, ValidationError):
+                queryset = choices.queryset.none()
+        self.choices = [choices.choice(obj) for obj in queryset]
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = choices
+
+
+class LazyModelMultipleChoiceField(forms.ModelMultipleChoiceField):
+    """
+    A ModelMultipleChoiceField which choices are not loaded when rendered: only the selected ones are, the others are
+    looked up by the widget. Validation only queries the submitted values.
+    """
+    widget = LazySelectMultiple
+
+    def __init__(self, queryset, lookup_key=None, **kwargs):
+        super().__init__(queryset, **kwargs)
+        self.widget.lookup_key = lookup_key
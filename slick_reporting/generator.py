@@ -1,18 +1,80 @@
 from __future__ import unicode_literals
 
+import asyncio
 import datetime
 import logging
+import operator
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
-from django.db.models import Q, ForeignKey
+from django.db import connections
+from django.db.models import ExpressionWrapper, Q, ForeignKey, OuterRef, QuerySet, Subquery, Sum, Count, Value
+from django.db.models.functions import Coalesce, Trunc
+from django.utils.translation import get_language
 from inspect import isclass
+from types import MappingProxyType
 
 from .app_settings import SLICK_REPORTING_DEFAULT_CHARTS_ENGINE
-from .fields import SlickReportField
-from .helpers import get_field_from_query_text
+from .fields import SlickReportField, ComputationCache, FirstBalanceField
+from .helpers import get_field_from_query_text, get_local_datetime, get_prefixed_q, is_truncation_boundary
+from .profiling import ReportProfile, null_context
 from .registry import field_registry
 
 logger = logging.getLogger(__name__)
 
+HAVING_LOOKUPS = {
+    'exact': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'in': lambda value, values: value in values,
+}
+"""The lookups supported by `ReportGenerator.having`, and their python counterparts"""
+
+TIME_SERIES_TRUNCATION_KINDS = {
+    'daily': 'day',
+    'weekly': 'week',
+    'monthly': 'month',
+    'quarterly': 'quarter',
+    'annually': 'year',
+}
+
+
+class ColumnPlan(object):
+    """
+    The parsed columns of a report, compiled once per generator class and columns signature and shared by the report
+    runs. The columns are held as read only copies, each run works on its own copies, see `get_columns`.
+    """
+
+    def __init__(self, parsed_columns, time_series_columns, crosstab_columns, list_display_columns):
+        frozen = {}
+
+        def freeze(columns):
+            # a column listed in several groups stays one same object
+            return tuple(frozen.setdefault(id(x), MappingProxyType(dict(x))) for x in columns)
+
+        self.parsed_columns = freeze(parsed_columns)
+        self.time_series_columns = freeze(time_series_columns)
+        self.crosstab_columns = freeze(crosstab_columns)
+        self.list_display_columns = freeze(list_display_columns)
+
+    def get_columns(self):
+        """
+        Get a copy of the columns for a report run
+        :return: a tuple of the lists parsed_columns, time_series_columns, crosstab_columns & list_display_columns
+        """
+        copies = {}
+
+        def copy(columns):
+            return [copies.setdefault(id(x), dict(x)) for x in columns]
+
+        return (copy(self.parsed_columns), copy(self.time_series_columns), copy(self.crosstab_columns),
+                copy(self.list_display_columns))
+
 
 class ReportGenerator(object):
     """
@@ -98,17 +160,17 @@ class ReportGenerator(object):
     crosstab_compute_reminder = True
     """Include an an extra crosstab_columns for the outer group ( ie: all expects those `crosstab_ids`) """
 
-    show_empty_records = True
+    show_empty_records = False
     """
-    If group_by is set, this option control if the report result will include all objects regardless of appearing in the report_model/qs.
-    If set False, only those objects which are found in the report_model/qs
+    If group_by is set on a foreign key, this option controls if the report result will include all the objects of the
+    related model regardless of appearing in the report_model/qs.
     Example: Say you group by client
-    show_empty_records = True will get the computation fields for all clients in the Client model (including those who 
-    didnt make a transaction.
-    
-    show_empty_records = False will get the computation fields for all clients in the Client model (including those who 
-    didnt make a transaction.
-     
+    show_empty_records = True will get the computation fields for all clients in the Client model (including those who
+    didnt make a transaction), with zeros for those.
+    show_empty_records = False will get the computation fields only for the clients found in the report_model/qs.
+
+    The computation fields using the default query flow are computed as filtered aggregates over the clients reverse
+    relation, annotated on the clients query itself.
     """
 
     limit_records = None
@@ -117,6 +179,70 @@ class ReportGenerator(object):
     """
     swap_sign = False
 
+    time_series_single_query = True
+    """If True, the time series computation fields are computed in one query per fields group, grouped by the
+    `date_field` truncated to the period. Applies to daily, weekly, monthly, quarterly and annually patterns when the
+    series dates are aligned to the start of those periods.
+    First balances (needed by `__balance__` & co) are computed once for the first period, and carried forward by
+    adding each period movement."""
+
+    crosstab_single_query = True
+    """If True, the crosstab computation fields are computed in one query per fields group using an aggregate per
+    crosstab id, the reminder is derived from the total. Applies to Sum and Count computation fields."""
+
+    fuse_queries = True
+    """If True, computation fields sharing the same report_model, filters and group by are computed in one query
+    (one aggregate per field), instead of a query (or two) per field"""
+
+    preparation_workers = 0
+    """The number of threads used to prepare the computation fields (each group of fused fields) concurrently,
+    each issuing its queries on its own database connection. 0 prepares them one after the other in the current
+    thread. Beneficial on databases serving concurrent queries, like PostgreSQL, when the report has many independent
+    computation fields. As the threads use their own connections, they do not see the uncommitted changes of the
+    current transaction."""
+
+    iterator_chunk_size = 2000
+    """The number of records fetched at a time from the main queryset by `iter_report_data`"""
+
+    lazy_preparation = False
+    """If True, the computation fields are prepared on the first `get_report_data` (or `aget_report_data`) call,
+    instead of on init. Needed to create the generator in async code."""
+
+    order_by = None
+    """A list of the report columns names to order the report by, prefixed with '-' for a descending order.
+    Database columns are ordered by the database, and so are the computation fields computed by a single aggregate
+    (see `SlickReportField.get_aggregate_expression`) in a grouped report: the report is ordered and limited in SQL,
+    and the other fields are computed for the page keys only. Other computation fields are computed for all the
+    records first. Only the first computation field column is used. Columns not on the report are ignored."""
+
+    having = None
+    """A dict filtering a grouped report by its computation field columns values, like a SQL HAVING clause,
+    ie: `{'__total__': ('gt', 1000), '__balance__': ('ne', 0)}`. See `HAVING_LOOKUPS` for the supported lookups.
+    The fields computed by an aggregate (see `SlickReportField.get_aggregate_expression`) are filtered in SQL, the
+    others are computed for all the groups first. The other columns are computed only for the remaining groups."""
+
+    page_offset = 0
+    """The index of the first record (or group by key) of the page to compute, used with `page_length`.
+    With `order_by`, `limit_records` caps the page as well, ie: `order_by=['-__total__'], limit_records=100` computes the
+    top 100."""
+
+    page_length = None
+    """If set, only a page of that many records (or group by keys) is computed, starting at `page_offset`.
+    The computation fields are computed for the page group by keys only, and the number of records over all the pages
+    is set on `records_filtered`."""
+
+    column_plans_cache_size = 128
+    """The number of column plans (the parsed columns) cached per generator class, keyed by the columns, group by,
+    time series & crosstab options, the dates range and the active language. 0 disables the cache.
+    Overridden columns hooks, like `get_time_series_field_verbose_name`, should only depend on those."""
+
+    _column_plans_lock = threading.Lock()
+
+    profile_report = False
+    """If True, the queries issued and the time spent in each phase of the report run are collected in `profile`,
+    a `slick_reporting.profiling.ReportProfile` instance. Each query is attributed to the column and the window
+    (normal, time_series or crosstab) it was issued for."""
+
     def __init__(self, report_model=None, main_queryset=None, start_date=None, end_date=None, date_field=None,
                  q_filters=None, kwargs_filters=None,
                  group_by=None, columns=None,
@@ -124,7 +250,9 @@ class ReportGenerator(object):
                  crosstab_model=None, crosstab_columns=None, crosstab_ids=None, crosstab_compute_reminder=None,
                  swap_sign=False, show_empty_records=None,
                  print_flag=False,
-                 doc_type_plus_list=None, doc_type_minus_list=None, limit_records=False, format_row_func=None):
+                 doc_type_plus_list=None, doc_type_minus_list=None, limit_records=False, format_row_func=None,
+                 profile_report=None, preparation_workers=None, lazy_preparation=None,
+                 order_by=None, page_offset=None, page_length=None, having=None):
         """
 
         :param report_model: Main model containing the data
@@ -149,6 +277,13 @@ class ReportGenerator(object):
         :param doc_type_plus_list:
         :param doc_type_minus_list:
         :param limit_records:
+        :param profile_report: collect the report run queries and timings in `profile`
+        :param preparation_workers: the number of threads preparing the computation fields concurrently
+        :param lazy_preparation: prepare the computation fields on the first `get_report_data` call
+        :param order_by: a list of columns names to order the report by
+        :param page_offset: the index of the first record of the page
+        :param page_length: the number of records in the page
+        :param having: a dict of {computation field column: (lookup, value)} to filter the groups by
         """
         from .app_settings import SLICK_REPORTING_DEFAULT_START_DATE, SLICK_REPORTING_DEFAULT_END_DATE
 
@@ -189,6 +324,27 @@ class ReportGenerator(object):
 
         self._prepared_results = {}
         self.report_fields_classes = {}
+        self._computation_cache = ComputationCache()
+        self._report_fields_columns = {}
+        # the fields annotated on the main queryset, with their aliases prefix, resolved from each record
+        self._annotated_fields = []
+
+        self.preparation_workers = self.preparation_workers if preparation_workers is None else preparation_workers
+        self.lazy_preparation = self.lazy_preparation if lazy_preparation is None else lazy_preparation
+        self._prepared = False
+
+        self.order_by = order_by or self.order_by or []
+        self.page_offset = self.page_offset if page_offset is None else page_offset
+        self.page_length = self.page_length if page_length is None else page_length
+        self.having = having or self.having or {}
+        self.records_filtered = None
+        # restricts the grouped computation fields to the page (or the filtered) group by keys
+        self._group_keys_filters = {}
+        # the rollups states, loaded once for all the computation fields
+        self._rollup_states = {}
+
+        profile_report = self.profile_report if profile_report is None else profile_report
+        self.profile = ReportProfile() if profile_report else None
 
         self._report_fields_dependencies = {'time_series': {}, 'crosstab': {}, 'normal': {}}
         self.existing_dependencies = {'series': [], 'matrix': [], 'normal': []}
@@ -227,40 +383,47 @@ class ReportGenerator(object):
 
         # in case of a group by, do we show a grouped by model data regardless of their appearance in the results
         # a client who didnt make a transaction during the date period.
-        self.show_empty_records = False  # show_empty_records if show_empty_records else self.show_empty_records
-        # Looks like this options is harder then what i thought as it interfere with the usual filtering of the report
+        self.show_empty_records = self.show_empty_records if show_empty_records is None else show_empty_records
 
         # Preparing actions
-        self._parse()
+        self._run_phase('_parse', self._parse)
         if self.group_by:
-
-            if self.show_empty_records:
-                pass
-                # group_by_filter = self.kwargs_filters.get(self.group_by, '')
-                # qs = self.group_by_field.related_model.objects
-                # if group_by_filter:
-                #     lookup = 'pk__in' if isinstance(group_by_filter, Iterable) else 'pk'
-                #     qs = qs.filter(**{lookup: group_by_filter})
-                # self.main_queryset = qs.values()
-
-            else:
-                self.main_queryset = self._apply_queryset_options(main_queryset)
-                if type(self.group_by_field) is ForeignKey and '__' not in self.group_by:
-                    ids = self.main_queryset.values_list(self.group_by_field_attname).distinct()
-                    # uses the same logic that is in Django's query.py when fields is empty in values() call
-                    concrete_fields = [f.name for f in self.group_by_field.related_model._meta.concrete_fields]
-                    # add database columns that are not already in concrete_fields
-                    final_fields = concrete_fields + list(set(self.get_database_columns()) - set(concrete_fields))
-                    self.main_queryset = self.group_by_field.related_model.objects.filter(pk__in=ids).values(
-                        *final_fields)
+            self.main_queryset = self._apply_queryset_options(main_queryset)
+            if type(self.group_by_field) is ForeignKey and '__' not in self.group_by:
+                related_model = self.group_by_field.related_model
+                # uses the same logic that is in Django's query.py when fields is empty in values() call
+                concrete_fields = [f.name for f in related_model._meta.concrete_fields]
+                # add database columns that are not already in concrete_fields
+                final_fields = concrete_fields + list(set(self.get_database_columns()) - set(concrete_fields))
+                if self.show_empty_records:
+                    queryset = related_model.objects.filter(**self._get_group_by_model_filters())
                 else:
-                    self.main_queryset = self.main_queryset.distinct().values(self.group_by_field_attname)
+                    ids = self.main_queryset.values_list(self.group_by_field_attname).distinct()
+                    queryset = related_model.objects.filter(pk__in=ids)
+                self.main_queryset = queryset.values(*final_fields)
+            else:
+                self.main_queryset = self.main_queryset.distinct().values(self.group_by_field_attname)
         else:
             if self.time_series_pattern:
                 self.main_queryset = [{}]
             else:
                 self.main_queryset = self._apply_queryset_options(main_queryset, self.get_database_columns())
-        self._prepare_report_dependencies()
+        if not self.lazy_preparation:
+            self._prepare_report()
+
+    def _run_phase(self, name, method):
+        if self.profile is None:
+            return method()
+        with self.profile.capture(), self.profile.phase(name):
+            return method()
+
+    def _profile_attribution(self, field, window):
+        """
+        Attribute the queries issued in the block to the given field (or column) name & window, if profiling
+        """
+        if self.profile is None:
+            return null_context()
+        return self.profile.attribute(field, window)
 
     def _apply_queryset_options(self, query, fields=None):
         """
@@ -282,6 +445,44 @@ class ReportGenerator(object):
             return query.values(*fields)
         return query.values()
 
+    def _get_group_by_model_filters(self):
+        """
+        Translate the `kwargs_filters` on the group by foreign key to filters on its related model
+        ex: {'client_id__in': [1, 2]} to {'pk__in': [1, 2]}
+        :return: a dict of filters
+        """
+        related_model = self.group_by_field.related_model
+        filters = {}
+        for key, value in self.kwargs_filters.items():
+            field_name, _, lookup = key.partition('__')
+            if field_name not in (self.group_by, self.group_by_field_attname):
+                continue
+            if field_name == self.group_by and lookup:
+                try:
+                    related_model._meta.get_field(lookup.split('__')[0])
+                    filters[lookup] = value
+                    continue
+                except FieldDoesNotExist:
+                    pass
+            filters['__'.join(['pk', lookup]) if lookup else 'pk'] = value
+        return filters
+
+    def _apply_window_fields(self):
+        """
+        Annotate the records of a detail report with the computation fields computed by a window function,
+        records are then ordered by the date field so the values follow them.
+        """
+        annotations = {}
+        for col_data in self._parsed_columns:
+            report_field = self.report_fields_classes.get(col_data['name'])
+            expression = report_field.get_window_expression() if report_field else None
+            if expression is not None:
+                # like the other computation fields, the displayed value is the opposite when swapping the sign
+                annotations[col_data['name']] = ExpressionWrapper(-expression, output_field=expression.output_field) \
+                    if self.swap_sign else expression
+        if annotations:
+            self.main_queryset = self.main_queryset.annotate(**annotations).order_by(self.date_field, 'pk')
+
     def _construct_crosstab_filter(self, col_data):
         """
         In charge of adding the needed crosstab filter, specific to the case of is_reminder or not
@@ -294,8 +495,267 @@ class ReportGenerator(object):
             filters = [Q(**{f"{col_data['model']}_id": col_data['id']})]
         return filters
 
+    def _prepare_report(self):
+        paginate = self.order_by or self.page_length is not None
+        if self.group_by and (paginate or self.having):
+            self._run_phase('_paginate', self._paginate)
+        self._run_phase('_prepare_report_dependencies', self._prepare_report_dependencies)
+        if not self.group_by and not self.time_series_pattern:
+            self._apply_window_fields()
+            if paginate:
+                self._run_phase('_paginate', self._paginate)
+        self._prepared = True
+
+    async def _aprepare_report(self):
+        """
+        Async version of `_prepare_report`, the fields groups are prepared concurrently each in a thread, with its own
+        database connections.
+        """
+
+        def get_preparation_groups():
+            preparations = self._prepare_annotated_fields(self._get_report_preparations())
+            # the fields computed along the time series & crosstab queries may have lazy requirements
+            prepared = [x[0] for x in preparations]
+            for report_field in self.report_fields_classes.values():
+                if report_field not in prepared:
+                    report_field.evaluate_results()
+            return self._get_preparation_groups(preparations)
+
+        if self.group_by:
+            await sync_to_async(self._paginate)()
+        groups = await sync_to_async(get_preparation_groups)()
+        await asyncio.gather(*[sync_to_async(self._prepare_group_in_thread, thread_sensitive=False)(group)
+                               for group in groups])
+        if not self.group_by and not self.time_series_pattern:
+            self._apply_window_fields()
+            await sync_to_async(self._paginate)()
+        self._prepared = True
+
+    def _get_main_queryset_key_name(self):
+        """
+        Get the name of the main queryset records key, the group by value (or the record primary key if no group by)
+        """
+        if not self.group_by:
+            return 'pk'
+        if self.group_by_field.related_model and '__' not in self.group_by:
+            return self.get_primary_key_name(self.group_by_field.related_model)
+        return self.group_by_field_attname
+
+    def _paginate(self):
+        """
+        Filter the main queryset by `having`, order it by `order_by`, and restrict it to the page requested by
+        `page_offset` and `page_length`. In a grouped report, the computation fields are then restricted to the
+        remaining group by keys.
+        """
+        paginate = self.order_by or self.page_length is not None
+        if not (paginate or self.having) or not isinstance(self.main_queryset, QuerySet):
+            return
+        key_name = self._get_main_queryset_key_name()
+        columns = OrderedDict((x['name'], x) for x in
+                              self._parsed_columns + self._time_series_parsed_columns + self._crosstab_parsed_columns)
+        # the fields computed for all the records, which can be used as is once restricted
+        prepared_fields = self._apply_having(columns, key_name) if self.having and self.group_by else []
+
+        order_by = [x for x in self.order_by if x.lstrip('-') in columns]
+        database_columns = self.get_database_columns()
+        end = None if self.page_length is None else self.page_offset + self.page_length
+        if self.limit_records:
+            end = self.limit_records if end is None else min(end, self.limit_records)
+        if self.page_length is not None:
+            self.records_filtered = self.main_queryset.count()
+
+        computed_order = [x for x in order_by if x.lstrip('-') not in database_columns]
+        order_annotation = None
+        if computed_order and self.group_by:
+            order_annotation = self._get_column_annotation(columns[computed_order[0].lstrip('-')], key_name)
+
+        if not paginate:
+            keys = self.main_queryset.values_list(key_name, flat=True)
+        elif order_annotation is not None:
+            # the displayed value is the opposite of the computed one when swapping the sign
+            descending = computed_order[0].startswith('-') != bool(self.swap_sign)
+            queryset = self.main_queryset.annotate(slick_order_value=order_annotation).order_by(
+                '-slick_order_value' if descending else 'slick_order_value', key_name)
+            self.main_queryset = list(queryset[self.page_offset:end])
+            keys = [x[key_name] for x in self.main_queryset]
+        elif computed_order and self.group_by:
+            values, prepared_field = self._get_column_values(columns[computed_order[0].lstrip('-')], key_name)
+            prepared_fields.append(prepared_field)
+            keys = sorted(values, key=values.get, reverse=computed_order[0].startswith('-'))[self.page_offset:end]
+            records = {x[key_name]: x for x in self.main_queryset.filter(**{f'{key_name}__in': keys})}
+            self.main_queryset = [records[key] for key in keys if key in records]
+        else:
+            order_by = [x for x in order_by if x.lstrip('-') in database_columns]
+            queryset = self.main_queryset
+            if order_by or not queryset.ordered:
+                queryset = queryset.order_by(*order_by, key_name)
+            self.main_queryset = queryset[self.page_offset:end]
+            if not self.group_by:
+                return
+            self.main_queryset = list(self.main_queryset)
+            keys = [x[key_name] for x in self.main_queryset]
+
+        self._group_keys_filters[f'{self.group_by}__in'] = keys
+        for report_field, q_filters, col_data in prepared_fields:
+            key = report_field.get_computation_key(q_filters, self._get_column_filters(col_data))
+            self._computation_cache.add(key, report_field)
+
+    def _apply_having(self, columns, key_name):
+        """
+        Filter the main queryset records by the computation fields values, per `having`.
+        The fields computed by an aggregate are filtered in SQL, the others are computed for all the records first.
+        :param columns: a dict of {column name: column data}
+        :param key_name: the main queryset key name
+        :return: a list of (report_field, q_filters, col_data) of the fields computed for all the records
+        """
+        prepared_fields = []
+        for index, (name, (lookup, value)) in enumerate(self.having.items()):
+            if lookup not in HAVING_LOOKUPS:
+                raise ImproperlyConfigured(f'Unsupported having lookup "{lookup}" on {name}, options are '
+                                           f'{", ".join(HAVING_LOOKUPS)}')
+            if name not in columns:
+                raise ImproperlyConfigured(f'having is set on {name} which is not a column of the report')
+            col_data = columns[name]
+            annotation = self._get_column_annotation(col_data, key_name)
+            if annotation is not None:
+                alias = f'slick_having_{index}'
+                queryset = self.main_queryset.annotate(**{alias: -annotation if self.swap_sign else annotation})
+                if lookup == 'ne':
+                    self.main_queryset = queryset.exclude(**{alias: value})
+                else:
+                    self.main_queryset = queryset.filter(**{f'{alias}__{lookup}': value})
+            else:
+                values, prepared_field = self._get_column_values(col_data, key_name)
+                prepared_fields.append(prepared_field)
+                keys = [key for key, x in values.items() if HAVING_LOOKUPS[lookup](x, value)]
+                self.main_queryset = self.main_queryset.filter(**{f'{key_name}__in': keys})
+        return prepared_fields
+
+    def _get_column_annotation(self, col_data, key_name):
+        """
+        Get an expression computing a computation field column for each main queryset record, as a subquery of the
+        field aggregate over the report_model records of the record key.
+        :param col_data: the column data
+        :param key_name: the main queryset key name
+        :return: an expression or None if the field value can not be computed by an aggregate
+        """
+        if '__' in self.group_by:
+            return None
+        report_field = self._create_report_field(col_data['ref'])
+        expression = report_field.get_aggregate_expression()
+        if expression is None or report_field.prevent_group_by:
+            return None
+        q_filters = self._construct_crosstab_filter(col_data) if col_data in self._crosstab_parsed_columns else None
+        queryset = self._get_filtered_queryset(report_field, q_filters, self._get_column_filters(col_data))
+        queryset = queryset.filter(**{self.group_by: OuterRef(key_name)}).values(self.group_by).annotate(
+            slick_value=expression).values('slick_value')
+        output_field = report_field.get_aggregate_output_field()
+        return Coalesce(Subquery(queryset, output_field=output_field), Value(0), output_field=output_field)
+
+    def _get_column_values(self, col_data, key_name):
+        """
+        Compute a computation field column for all the main queryset keys
+        :param col_data: the column data
+        :param key_name: the main queryset key name
+        :return: a tuple of ({key: the value as displayed}, (the prepared report field, its q_filters, col_data))
+        """
+        report_field = self._create_report_field(col_data['ref'])
+        q_filters = self._construct_crosstab_filter(col_data) if col_data in self._crosstab_parsed_columns else None
+        with self._profile_attribution(col_data['name'], 'filter'):
+            report_field.init_preparation(q_filters, self._get_column_filters(col_data))
+            values = {}
+            for key in self.main_queryset.values_list(key_name, flat=True):
+                value = report_field.resolve(str(key)) or 0
+                values[key] = -value if self.swap_sign else value
+        return values, (report_field, q_filters, col_data)
+
+    def _get_column_filters(self, col_data):
+        """
+        Get the kwargs filters of a computation field column
+        """
+        kwargs_filters = {
+            f'{self.date_field}__gte': col_data.get('start_date', self.start_date),
+            f'{self.date_field}__lt': col_data.get('end_date', self.end_date),
+        }
+        kwargs_filters.update(self._get_kwargs_filters(col_data['ref']))
+        return kwargs_filters
+
+    def _get_kwargs_filters(self, klass):
+        """
+        Get the report kwargs filters of a computation field class. The grouped fields are restricted to the page (or
+        the `having` filtered) group by keys, the fields preventing the group by are computed over the whole report.
+        """
+        if klass.prevent_group_by:
+            return self.kwargs_filters
+        return dict(self.kwargs_filters, **self._group_keys_filters)
+
     def _prepare_report_dependencies(self):
+        self._prepare_fields(self._prepare_annotated_fields(self._get_report_preparations()))
+
+    def _can_annotate(self, report_field, q_filters=None, kwargs_filters=None):
+        """
+        Check if the field can be computed as an aggregate over the group by model reverse relation
+        """
+        # aggregates traversing another relation could multiply the reverse relation rows
+        return self.fuse_queries and report_field.can_fuse() and not report_field.prevent_group_by and \
+            '__' not in report_field.calculation_field and not report_field.get_rollup(q_filters, kwargs_filters)
+
+    def _prepare_annotated_fields(self, preparations):
+        """
+        When showing the empty records, compute the fields as filtered aggregates over the group by model reverse
+        relation, annotated on the main queryset: the groups without records get their zeros along in one query.
+        :param preparations: a list of tuples (report_field, q_filters, kwargs_filters)
+        :return: the preparations left to prepare
+        """
+        if not (self.show_empty_records and self.group_by and isinstance(self.main_queryset, QuerySet)
+                and self.group_by_field.related_model and '__' not in self.group_by):
+            return preparations
+        annotated = [x for x in preparations if self._can_annotate(*x)]
+        if not annotated:
+            return preparations
+
+        relation = self.group_by_field.related_query_name()
+        aggregates = {}
+        for index, (report_field, q_filters, kwargs_filters) in enumerate(annotated):
+            q_filters, kwargs_filters = report_field.prepare_filters(q_filters, kwargs_filters)
+            q_filters = list(report_field.base_q_filters or []) + list(q_filters or [])
+            kwargs_filters = dict(report_field.base_kwargs_filters or {}, **(kwargs_filters or {}))
+            q_filter = Q(*[get_prefixed_q(x, relation) for x in q_filters],
+                         **{f'{relation}__{k}': v for k, v in kwargs_filters.items()})
+            aggregates.update(report_field.get_conditional_aggregates(
+                alias_prefix=f'f{index}_', q_filter=q_filter, relation=relation))
+
+        # the main queryset is kept lazy, the fields results are read along each record
+        self.main_queryset = self.main_queryset.annotate(**aggregates)
+        for index, (report_field, q_filters, kwargs_filters) in enumerate(annotated):
+            debit_results, credit_results = report_field.split_conditional_results([], self.group_by,
+                                                                                   alias_prefix=f'f{index}_')
+            report_field.set_prepared_results(debit_results, credit_results, q_filters, kwargs_filters)
+            self._annotated_fields.append((report_field, f'f{index}_'))
+        return [x for x in preparations if x not in annotated]
+
+    def _set_annotated_results(self, obj):
+        """
+        Set the results of the fields annotated on the main queryset (see `_prepare_annotated_fields`) from the record
+        :param obj: the main queryset record
+        """
+        results = [dict(obj, **{self.group_by: obj[self._get_main_queryset_key_name()]})]
+        for report_field, alias_prefix in self._annotated_fields:
+            report_field.update_prepared_results(*report_field.split_conditional_results(
+                results, self.group_by, alias_prefix=alias_prefix))
+
+    def _get_report_preparations(self):
+        """
+        Get the computation fields needed by the report columns, and not already prepared
+        :return: a list of tuples (report_field, q_filters, kwargs_filters)
+        """
         from .fields import SlickReportField
+        if self.time_series_single_query:
+            self._prepare_time_series_in_one_query()
+        if self.crosstab_single_query:
+            self._prepare_crosstab_in_one_query()
+
+        preparations = []
         all_columns = (
             ('normal', self._parsed_columns),
             ('time_series', self._time_series_parsed_columns),
@@ -319,24 +779,432 @@ class ReportGenerator(object):
                 # if column has a dependency then skip it
                 if not (isclass(klass) and issubclass(klass, SlickReportField)):
                     continue
+                if klass.get_window_expression is not SlickReportField.get_window_expression and \
+                        (window != 'normal' or self.group_by or self.time_series_pattern):
+                    raise ImproperlyConfigured(f'{name} is computed on the records of a detail report, it can not be '
+                                               f'used with group_by, time series or crosstab')
                 if self._report_fields_dependencies[window].get(name, False):
                     continue
 
-                report_class = klass(self.doc_type_plus_list, self.doc_type_minus_list,
-                                     group_by=self.group_by,
-                                     report_model=self.report_model, date_field=self.date_field)
+                report_class = self._create_report_field(klass)
 
                 q_filters = None
-                date_filter = {
-                    f'{self.date_field}__gte': col_data.get('start_date', self.start_date),
-                    f'{self.date_field}__lt': col_data.get('end_date', self.end_date),
-                }
-                date_filter.update(self.kwargs_filters)
+                date_filter = self._get_column_filters(col_data)
                 if window == 'crosstab':
                     q_filters = self._construct_crosstab_filter(col_data)
 
-                report_class.init_preparation(q_filters, date_filter)
-                self.report_fields_classes[name] = report_class
+                # The same computation may be already requested by another column, or as a dependency
+                key = report_class.get_computation_key(q_filters, date_filter)
+                cached_report_class = self._computation_cache.add(key, report_class)
+                if cached_report_class is report_class:
+                    preparations.append((report_class, q_filters, date_filter))
+                    self._report_fields_columns[report_class] = name, window
+                self.report_fields_classes[name] = cached_report_class
+        return preparations
+
+    def _prepare_fields(self, preparations):
+        """
+        Prepare the computation fields, fusing those which can be computed in the same query.
+        :param preparations: a list of tuples (report_field, q_filters, kwargs_filters)
+        """
+        groups = self._get_preparation_groups(preparations)
+        if self.preparation_workers and len(groups) > 1:
+            self._prepare_groups_in_threads(groups)
+        else:
+            for group in groups:
+                self._prepare_group(group)
+
+    def _get_preparation_groups(self, preparations):
+        """
+        Group the preparations of the fields which can be computed in the same query
+        :param preparations: a list of tuples (report_field, q_filters, kwargs_filters)
+        :return: a list of preparations lists
+        """
+        groups = []
+        fused_groups = OrderedDict()
+        for report_field, q_filters, kwargs_filters in preparations:
+            key = report_field.get_fusion_key(q_filters, kwargs_filters) if self.fuse_queries else None
+            if key is not None and report_field.get_rollup(q_filters, kwargs_filters):
+                # computed from the rollup on its own
+                key = None
+            if key is None:
+                groups.append([(report_field, q_filters, kwargs_filters)])
+            else:
+                fused_groups.setdefault(key, []).append((report_field, q_filters, kwargs_filters))
+        return groups + list(fused_groups.values())
+
+    def _prepare_group(self, group, evaluate=False):
+        """
+        Prepare a group of fields, fused in one query if more than one
+        :param group: a list of tuples (report_field, q_filters, kwargs_filters)
+        :param evaluate: evaluate the prepared results right away
+        """
+        columns = [self._report_fields_columns.get(report_field, (None, None)) for report_field, _, _ in group]
+        field = columns[0][0] if len(columns) == 1 else ', '.join(str(x[0]) for x in columns)
+        with self._profile_attribution(field, columns[0][1]):
+            if len(group) == 1:
+                report_field, q_filters, kwargs_filters = group[0]
+                report_field.init_preparation(q_filters, kwargs_filters)
+            else:
+                self._prepare_fused_fields(group)
+            if evaluate:
+                for report_field, _, _ in group:
+                    report_field.evaluate_results()
+
+    def _prepare_groups_in_threads(self, groups):
+        """
+        Prepare the fields groups concurrently on a pool of `preparation_workers` threads.
+        Each thread uses its own database connections, which are closed once its preparation is done, and evaluates
+        the prepared results so the rows are resolved afterwards without issuing queries.
+        """
+        with ThreadPoolExecutor(max_workers=min(self.preparation_workers, len(groups))) as executor:
+            # consuming the results re-raises the exceptions raised in the threads
+            list(executor.map(self._prepare_group_in_thread, groups))
+
+    def _prepare_group_in_thread(self, group):
+        try:
+            with self.profile.capture() if self.profile is not None else null_context():
+                self._prepare_group(group, evaluate=True)
+        finally:
+            connections.close_all()
+
+    def _prepare_fused_fields(self, preparations):
+        """
+        Compute a group of report fields sharing the same fusion key in one query
+        :param preparations: a list of tuples (report_field, q_filters, kwargs_filters)
+        """
+        report_field, q_filters, kwargs_filters = preparations[0]
+        group_by = '' if report_field.prevent_group_by else report_field.group_by
+        queryset = self._get_filtered_queryset(report_field, q_filters, kwargs_filters)
+
+        aggregates = {}
+        for index, (report_field, _, _) in enumerate(preparations):
+            aggregates.update(report_field.get_conditional_aggregates(alias_prefix=f'f{index}_'))
+        if group_by:
+            results = list(queryset.values(group_by).annotate(**aggregates))
+        else:
+            results = queryset.aggregate(**aggregates)
+
+        for index, (report_field, q_filters, kwargs_filters) in enumerate(preparations):
+            debit_results, credit_results = report_field.split_conditional_results(results, group_by,
+                                                                                   alias_prefix=f'f{index}_')
+            report_field.set_prepared_results(debit_results, credit_results, q_filters, kwargs_filters)
+
+    @staticmethod
+    def _get_filtered_queryset(report_field, q_filters=None, kwargs_filters=None):
+        q_filters, kwargs_filters = report_field.prepare_filters(q_filters, kwargs_filters)
+        queryset = report_field.get_queryset()
+        if q_filters:
+            queryset = queryset.filter(*q_filters)
+        if kwargs_filters:
+            queryset = queryset.filter(**kwargs_filters)
+        return queryset
+
+    def _create_report_field(self, klass):
+        report_field = klass(self.doc_type_plus_list, self.doc_type_minus_list,
+                             group_by=self.group_by,
+                             report_model=self.report_model, date_field=self.date_field)
+        report_field.computation_cache = self._computation_cache
+        report_field.group_keys_filters = self._group_keys_filters
+        report_field.rollup_states = self._rollup_states
+        return report_field
+
+    @staticmethod
+    def _get_dependency_ordered_classes(classes):
+        """
+        Return the given computation field classes along with their full dependencies, dependencies coming first
+        """
+        ordered = []
+
+        def add(klass):
+            if klass in ordered:
+                return
+            for dependency in klass._get_required_classes():
+                add(dependency)
+            ordered.append(klass)
+
+        for klass in classes:
+            add(klass)
+        return ordered
+
+    def _get_time_series_truncation(self, series):
+        """
+        Get the database truncation kind matching the time series pattern, only if the series periods starts
+        (and ends) exactly on the truncation boundaries.
+        :param series: the time series dates
+        :return: the truncation kind or None
+        """
+        kind = TIME_SERIES_TRUNCATION_KINDS.get(self.time_series_pattern) \
+            if type(self.time_series_pattern) is str else None
+        if not kind or not series:
+            return None
+        for start_date, end_date in series:
+            if not (is_truncation_boundary(start_date, kind) and is_truncation_boundary(end_date, kind)):
+                return None
+        return kind
+
+    def _prepare_time_series_in_one_query(self):
+        """
+        Compute the time series fields using one query per fields group, grouping by the truncated `date_field`,
+        then distribute the results on each period computation fields via the computation cache.
+        Fields customizing their query flow (and those depending on them) are left to the usual per period flow.
+        """
+        series = self._get_time_series_dates()
+        kind = self._get_time_series_truncation(series)
+        if not kind:
+            return
+
+        def get_series_filters(klass):
+            return dict({
+                f'{self.date_field}__gte': series[0][0],
+                f'{self.date_field}__lt': series[-1][1],
+            }, **self._get_kwargs_filters(klass))
+
+        classes = []
+        for col_data in self._time_series_parsed_columns:
+            klass = col_data['ref']
+            if klass in classes:
+                continue
+            dependencies = [klass] + klass.get_full_dependency_list()
+            if all(self._can_truncate(self._create_report_field(x), get_series_filters(x)) or
+                   self._is_first_balance(self._create_report_field(x)) for x in dependencies):
+                classes.append(klass)
+        if not classes:
+            return
+        classes = self._get_dependency_ordered_classes(classes)
+
+        groups = OrderedDict()
+        for klass in classes:
+            report_field = self._create_report_field(klass)
+            key = report_field.get_query_key(None, self._get_kwargs_filters(klass))
+            groups.setdefault(key, []).append(klass)
+
+        results = {}
+        for group in groups.values():
+            with self._profile_attribution(', '.join(x.name for x in group), 'time_series'):
+                results.update(self._get_truncated_results(group, series, kind))
+
+        for klass in classes:
+            report_field = self._create_report_field(klass)
+            if self._is_first_balance(report_field):
+                # the truncated results are the movement over each period, carry the first balance forward with them
+                movements = [results[klass][get_local_datetime(start_date)] for start_date, end_date in series]
+                opening_filters = {
+                    f'{self.date_field}__gte': series[0][0],
+                    f'{self.date_field}__lt': series[0][1],
+                }
+                opening_filters.update(self._get_kwargs_filters(klass))
+                with self._profile_attribution(klass.name, 'time_series'):
+                    opening = report_field.prepare(None, opening_filters)
+                    balances = self._get_running_balances(report_field, opening, movements)
+                results[klass] = {get_local_datetime(start_date): balance
+                                  for (start_date, end_date), balance in zip(series, balances)}
+
+        for start_date, end_date in series:
+            period = get_local_datetime(start_date)
+            for klass in classes:
+                kwargs_filters = {
+                    f'{self.date_field}__gte': start_date,
+                    f'{self.date_field}__lt': end_date,
+                }
+                kwargs_filters.update(self._get_kwargs_filters(klass))
+                report_field = self._create_report_field(klass)
+                debit_results, credit_results = results[klass][period]
+                report_field.set_prepared_results(debit_results, credit_results, None, kwargs_filters)
+                self._computation_cache.add(report_field.get_computation_key(None, kwargs_filters), report_field)
+
+    def _can_truncate(self, report_field, kwargs_filters=None):
+        # the periods of a field computed from a rollup are cheaper computed on their own
+        return report_field.can_fuse() and type(report_field).prepare_filters is SlickReportField.prepare_filters \
+            and not report_field.get_rollup(None, kwargs_filters)
+
+    @staticmethod
+    def _is_first_balance(report_field):
+        klass = type(report_field)
+        return klass.prepare in (SlickReportField.prepare, FirstBalanceField.prepare) and \
+            klass.prepare_filters is FirstBalanceField.prepare_filters and report_field.has_default_aggregation()
+
+    @staticmethod
+    def _get_running_balances(report_field, opening, movements):
+        """
+        Get the balance at the start of each period given the opening balance and each period movement
+        :param report_field: the first balance report field
+        :param opening: the (debit_results, credit_results) before the first period
+        :param movements: a list of (debit_results, credit_results), one for each period
+        :return: a list of (debit_results, credit_results) for each period
+        """
+        group_by = '' if report_field.prevent_group_by else report_field.group_by
+        annotation = report_field.get_annotation_name()
+
+        def to_dict(results):
+            if results is None:
+                return None
+            if not group_by:
+                return {None: results.get(annotation)}
+            return {str(x[group_by]): x[annotation] for x in results}
+
+        def from_dict(values):
+            if values is None:
+                return None
+            if not group_by:
+                return {annotation: values[None]}
+            return [{group_by: key, annotation: value} for key, value in values.items()]
+
+        running = [to_dict(opening[0]), to_dict(opening[1])]
+        balances = []
+        for movement in movements:
+            balances.append((from_dict(running[0]), from_dict(running[1])))
+            for side, side_running in enumerate(running):
+                if side_running is None:
+                    continue
+                for key, value in to_dict(movement[side]).items():
+                    if value is not None:
+                        side_running[key] = (side_running.get(key) or 0) + value
+        return balances
+
+    def _get_truncated_results(self, classes, series, kind):
+        """
+        Compute the given computation fields classes over the whole series in one query
+        :return: a dict of {klass: {period start: (debit_results, credit_results)}}
+        """
+        report_fields = [self._create_report_field(klass) for klass in classes]
+        report_field = report_fields[0]
+        group_by = '' if report_field.prevent_group_by else report_field.group_by
+        kwargs_filters = {
+            f'{self.date_field}__gte': series[0][0],
+            f'{self.date_field}__lt': series[-1][1],
+        }
+        kwargs_filters.update(self._get_kwargs_filters(classes[0]))
+        # `prepare_filters` is not applied, for first balances the needed result is the movement over each period
+        queryset = report_field.get_queryset().filter(**kwargs_filters)
+
+        aggregates = {}
+        for index, report_field in enumerate(report_fields):
+            aggregates.update(report_field.get_conditional_aggregates(alias_prefix=f'f{index}_'))
+        values = [group_by, 'ts_period'] if group_by else ['ts_period']
+        rows = queryset.annotate(ts_period=Trunc(self.date_field, kind)).values(*values).annotate(**aggregates)
+
+        rows_per_period = {get_local_datetime(start_date): [] for start_date, end_date in series}
+        for row in rows:
+            rows_per_period[get_local_datetime(row['ts_period'])].append(row)
+
+        results = {}
+        for index, report_field in enumerate(report_fields):
+            klass_results = results[type(report_field)] = {}
+            for period, period_rows in rows_per_period.items():
+                if group_by:
+                    period_results = period_rows
+                else:
+                    period_results = period_rows[0] if period_rows else dict.fromkeys(aggregates)
+                klass_results[period] = report_field.split_conditional_results(period_results, group_by,
+                                                                               alias_prefix=f'f{index}_')
+        return results
+
+    def _can_pivot(self, report_field):
+        prepare_filters = type(report_field).prepare_filters
+        return report_field.can_fuse() and issubclass(report_field.calculation_method, (Sum, Count)) and \
+            prepare_filters in (SlickReportField.prepare_filters, FirstBalanceField.prepare_filters)
+
+    def _prepare_crosstab_in_one_query(self):
+        """
+        Compute the crosstab fields using one query per fields group, with an aggregate for each crosstab id,
+        then distribute the results on each crosstab column computation fields via the computation cache.
+        The reminder is computed as the total minus the crosstab ids values, hence only additive aggregates (Sum and
+        Count) are computed this way, others are left to the usual per crosstab id flow.
+        """
+        if not (self.group_by and self.crosstab_model and self._crosstab_parsed_columns):
+            return
+
+        classes = []
+        for col_data in self._crosstab_parsed_columns:
+            klass = col_data['ref']
+            if klass in classes:
+                continue
+            dependencies = [klass] + klass.get_full_dependency_list()
+            if all(self._can_pivot(self._create_report_field(x)) for x in dependencies):
+                classes.append(klass)
+        if not classes:
+            return
+        classes = self._get_dependency_ordered_classes(classes)
+
+        def get_kwargs_filters(klass):
+            return dict({
+                f'{self.date_field}__gte': self.start_date,
+                f'{self.date_field}__lt': self.end_date,
+            }, **self._get_kwargs_filters(klass))
+
+        groups = OrderedDict()
+        for klass in classes:
+            report_field = self._create_report_field(klass)
+            key = report_field.get_fusion_key(None, get_kwargs_filters(klass))
+            groups.setdefault(key, []).append(klass)
+
+        results = {}
+        for group in groups.values():
+            with self._profile_attribution(', '.join(x.name for x in group), 'crosstab'):
+                results.update(self._get_pivot_results(group, get_kwargs_filters(group[0])))
+
+        crosstab_columns = OrderedDict((x['id'], x) for x in self._crosstab_parsed_columns)
+        for crosstab_id, col_data in crosstab_columns.items():
+            q_filters = self._construct_crosstab_filter(col_data)
+            for klass in classes:
+                report_field = self._create_report_field(klass)
+                kwargs_filters = get_kwargs_filters(klass)
+                debit_results, credit_results = results[klass][crosstab_id]
+                report_field.set_prepared_results(debit_results, credit_results, q_filters, kwargs_filters)
+                self._computation_cache.add(report_field.get_computation_key(q_filters, kwargs_filters), report_field)
+
+    def _get_pivot_results(self, classes, kwargs_filters):
+        """
+        Compute the given computation fields classes for all the crosstab ids (and the reminder) in one query
+        :return: a dict of {klass: {crosstab id: (debit_results, credit_results)}}
+        """
+        report_fields = [self._create_report_field(klass) for klass in classes]
+        report_field = report_fields[0]
+        group_by = '' if report_field.prevent_group_by else report_field.group_by
+        queryset = self._get_filtered_queryset(report_field, None, kwargs_filters)
+        crosstab_key = f'{self.crosstab_model}_id'
+
+        aggregates = {}
+        for index, report_field in enumerate(report_fields):
+            for position, crosstab_id in enumerate(self.crosstab_ids):
+                aggregates.update(report_field.get_conditional_aggregates(
+                    alias_prefix=f'f{index}_c{position}_', q_filter=Q(**{crosstab_key: crosstab_id})))
+            if self.crosstab_compute_reminder:
+                # the total over all the records, including those without a crosstab model, as the reminder filter
+                # (`~Q(<crosstab>_id__in=ids)`) matches them
+                aggregates.update(report_field.get_conditional_aggregates(alias_prefix=f'f{index}_total_'))
+
+        if group_by:
+            rows = list(queryset.values(group_by).annotate(**aggregates))
+        else:
+            rows = [queryset.aggregate(**aggregates)]
+
+        results = {}
+        for index, report_field in enumerate(report_fields):
+            if self.crosstab_compute_reminder:
+                self._add_pivot_reminder(rows, report_field, index)
+            klass_results = results[type(report_field)] = {}
+            aliases_prefixes = [(crosstab_id, f'f{index}_c{position}_')
+                                for position, crosstab_id in enumerate(self.crosstab_ids)]
+            if self.crosstab_compute_reminder:
+                aliases_prefixes.append(('----', f'f{index}_reminder_'))
+            for crosstab_id, alias_prefix in aliases_prefixes:
+                klass_results[crosstab_id] = report_field.split_conditional_results(
+                    rows if group_by else rows[0], group_by, alias_prefix=alias_prefix)
+        return results
+
+    def _add_pivot_reminder(self, rows, report_field, index):
+        """
+        Add the reminder aliases to the pivot rows, computed as the total minus the crosstab ids values
+        """
+        for alias in report_field.get_conditional_aggregates():
+            for row in rows:
+                value = row[f'f{index}_total_{alias}']
+                if value is not None:
+                    for position in range(len(self.crosstab_ids)):
+                        value -= row[f'f{index}_c{position}_{alias}'] or 0
+                row[f'f{index}_reminder_{alias}'] = value
 
     @staticmethod
     def get_primary_key_name(model):
@@ -353,6 +1221,8 @@ class ReportGenerator(object):
         :return: a dict object containing all needed data
         """
 
+        if self._annotated_fields:
+            self._set_annotated_results(obj)
         data = {}
         group_by_val = None
         if self.group_by:
@@ -374,14 +1244,16 @@ class ReportGenerator(object):
                     source = self._report_fields_dependencies[window].get(name, False)
                     if source:
                         computation_class = self.report_fields_classes[source]
-                        value = computation_class.get_dependency_value(group_by_val,
-                                                                       col_data['ref'].name)
+                        with self._profile_attribution(name, window):
+                            value = computation_class.get_dependency_value(group_by_val,
+                                                                           col_data['ref'].name)
                     else:
                         try:
                             computation_class = self.report_fields_classes[name]
                         except KeyError:
                             continue
-                        value = computation_class.resolve(group_by_val, data)
+                        with self._profile_attribution(name, window):
+                            value = computation_class.resolve(group_by_val, data)
                     if self.swap_sign: value = -value
                     data[name] = value
 
@@ -390,7 +1262,18 @@ class ReportGenerator(object):
         return data
 
     def get_report_data(self):
+        return list(self.iter_report_data())
+
+    def iter_report_data(self):
+        """
+        Yield the report rows one at a time, reading the main queryset in chunks of `iterator_chunk_size` records
+        (using server side cursors where the database supports them), so the whole report is never held in memory.
+        """
+        if not self._prepared:
+            self._prepare_report()
         main_queryset = self.main_queryset[:self.limit_records] if self.limit_records else self.main_queryset
+        if isinstance(main_queryset, QuerySet):
+            main_queryset = main_queryset.iterator(chunk_size=self.iterator_chunk_size)
 
         all_columns = (
             ('normal', self._parsed_columns),
@@ -398,10 +1281,59 @@ class ReportGenerator(object):
             ('crosstab', self._crosstab_parsed_columns),
         )
 
+        if self.profile is not None:
+            yield from self._iter_profiled_report_data(main_queryset, all_columns)
+            return
+
         get_record_data = self._get_record_data
         format_row = self.format_row
-        data = [format_row(get_record_data(obj, all_columns)) for obj in main_queryset]
-        return data
+        for obj in main_queryset:
+            yield format_row(get_record_data(obj, all_columns))
+
+    async def aget_report_data(self):
+        """
+        Async version of `get_report_data`.
+        The computation fields are prepared concurrently (each group of fused fields in a thread, with its own database
+        connections), and the main queryset is fetched with the async ORM. Create the generator with
+        `lazy_preparation=True` when in async code, so no query is issued on init.
+        """
+        if not self._prepared:
+            await self._aprepare_report()
+        main_queryset = self.main_queryset[:self.limit_records] if self.limit_records else self.main_queryset
+        if isinstance(main_queryset, QuerySet):
+            if hasattr(main_queryset, '__aiter__'):
+                main_queryset = [obj async for obj in main_queryset]
+            else:
+                # no async iteration before Django 4.1
+                main_queryset = await sync_to_async(list)(main_queryset)
+
+        all_columns = (
+            ('normal', self._parsed_columns),
+            ('time_series', self._time_series_parsed_columns),
+            ('crosstab', self._crosstab_parsed_columns),
+        )
+        get_record_data = self._get_record_data
+        format_row = self.format_row
+        return [format_row(get_record_data(obj, all_columns)) for obj in main_queryset]
+
+    def _iter_profiled_report_data(self, main_queryset, all_columns):
+        """
+        Same as `iter_report_data`, collecting the queries and the time spent on the main queryset, the row assembly
+        and `format_row` in `profile`
+        """
+        profile = self.profile
+        records = iter(main_queryset)
+        while True:
+            with profile.capture():
+                with profile.phase('main_queryset'):
+                    obj = next(records, None)
+                if obj is None:
+                    return
+                with profile.phase('row_assembly'):
+                    row = self._get_record_data(obj, all_columns)
+                with profile.phase('format_row'):
+                    row = self.format_row(row)
+            yield row
 
     def _default_format_row(self, row_obj):
         """
@@ -495,37 +1427,88 @@ class ReportGenerator(object):
         return parsed_columns
 
     def _parse(self):
-        self.parsed_columns = self.check_columns(self.columns, self.group_by, self.report_model)
+        self._column_plan = self.get_column_plan()
+        self.parsed_columns, self._time_series_parsed_columns, self._crosstab_parsed_columns, \
+            self._list_display_columns = self._column_plan.get_columns()
         self._parsed_columns = list(self.parsed_columns)
-        self._time_series_parsed_columns = self.get_time_series_parsed_columns()
-        self._crosstab_parsed_columns = self.get_crosstab_parsed_columns()
 
-    def get_database_columns(self):
-        return [col['name'] for col in self.parsed_columns if 'source' in col and col['source'] == 'database']
+    def get_column_plan(self):
+        """
+        Get the compiled column plan of this report, from the class cache if it was already compiled
+        :return: a `ColumnPlan`
+        """
+        key = self._get_column_plan_key() if self.column_plans_cache_size else None
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        if key is None:
+            return self._compile_column_plan()
+
+        cls = type(self)
+        with cls._column_plans_lock:
+            if '_column_plans' not in cls.__dict__:
+                cls._column_plans = OrderedDict()
+            plan = cls._column_plans.get(key)
+            if plan is not None:
+                cls._column_plans.move_to_end(key)
+                return plan
+        plan = self._compile_column_plan()
+        with cls._column_plans_lock:
+            cls._column_plans[key] = plan
+            while len(cls._column_plans) > self.column_plans_cache_size:
+                cls._column_plans.popitem(last=False)
+        return plan
 
-    # def get_method_columns(self):
-    #     return [col['name'] for col in self.parsed_columns if col['type'] == 'method']
+    @classmethod
+    def clear_column_plans(cls):
+        """
+        Clear the column plans cached for this generator class
+        """
+        with cls._column_plans_lock:
+            cls.__dict__.get('_column_plans', {}).clear()
+
+    def _get_column_plan_key(self):
+        def get_signature(columns):
+            return tuple((x[0], repr(sorted(x[1].items()))) if type(x) is tuple else x for x in columns or [])
+
+        return (
+            self.report_model, self.group_by, get_signature(self.columns),
+            self.time_series_pattern, get_signature(self.time_series_columns),
+            tuple(self._get_time_series_dates()) if self.time_series_pattern else None,
+            self.crosstab_model, get_signature(self.crosstab_columns), tuple(self.crosstab_ids),
+            self.crosstab_compute_reminder, get_language(),
+        )
 
-    def get_list_display_columns(self):
-        columns = self.parsed_columns
+    def _compile_column_plan(self):
+        parsed_columns = self.check_columns(self.columns, self.group_by, self.report_model)
+        time_series_columns = self.get_time_series_parsed_columns()
+        crosstab_columns = self.get_crosstab_parsed_columns()
+
+        list_display_columns = list(parsed_columns)
         if self.time_series_pattern:
-            time_series_columns = self.get_time_series_parsed_columns()
             try:
                 index = self.columns.index('__time_series__')
-                columns[index:index] = time_series_columns
+                list_display_columns[index:index] = time_series_columns
             except ValueError:
-                columns += time_series_columns
+                list_display_columns += time_series_columns
 
         if self.crosstab_model:
-            crosstab_columns = self.get_crosstab_parsed_columns()
-
             try:
                 index = self.columns.index('__crosstab__')
-                columns[index:index] = crosstab_columns
+                list_display_columns[index:index] = crosstab_columns
             except ValueError:
-                columns += crosstab_columns
+                list_display_columns += crosstab_columns
+        return ColumnPlan(parsed_columns, time_series_columns, crosstab_columns, list_display_columns)
 
-        return columns
+    def get_database_columns(self):
+        return [col['name'] for col in self.parsed_columns if 'source' in col and col['source'] == 'database']
+
+    # def get_method_columns(self):
+    #     return [col['name'] for col in self.parsed_columns if col['type'] == 'method']
+
+    def get_list_display_columns(self):
+        return list(self._list_display_columns)
 
     def get_time_series_parsed_columns(self):
         """
@@ -627,8 +1610,7 @@ class ReportGenerator(object):
         if self.crosstab_compute_reminder:
             ids.append('----')
         output_cols = []
-        ids_length = len(ids) - 1
-        for counter, id in enumerate(ids):
+        for id in ids:
             for col in report_columns:
                 magic_field_class = None
                 if type(col) is str:
@@ -643,7 +1625,7 @@ class ReportGenerator(object):
                     'ref': magic_field_class,
                     'id': id,
                     'model': self.crosstab_model,
-                    'is_reminder': counter == ids_length,
+                    'is_reminder': id == '----',
                     'source': 'magic_field' if magic_field_class else '',
                     'is_summable': magic_field_class.is_summable,
                 })
@@ -665,8 +1647,8 @@ class ReportGenerator(object):
                 A hook to send data about the report for front end which can later be used in charting
                 :return:
                 """
-        time_series_columns = self.get_time_series_parsed_columns()
-        crosstab_columns = self.get_crosstab_parsed_columns()
+        time_series_columns = self._time_series_parsed_columns
+        crosstab_columns = self._crosstab_parsed_columns
         metadata = {
             'time_series_pattern': self.time_series_pattern,
             'time_series_column_names': [x['name'] for x in time_series_columns],
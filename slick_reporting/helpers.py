@@ -14,6 +14,38 @@ def get_calculation_annotation(calculation_field, calculation_method):
     return '__'.join([calculation_field.lower(), calculation_method.name.lower()])
 
 
+def _get_filter_value_signature(value):
+    from django.db.models import QuerySet
+    if isinstance(value, QuerySet):
+        # avoid evaluating the queryset
+        return str(value.query)
+    return repr(value)
+
+
+def get_filters_signature(q_filters=None, kwargs_filters=None):
+    """
+    Returns a hashable representation of the filters, usable to compare or cache by them.
+    @param q_filters: a list of Q objects
+    @param kwargs_filters: a dict of filters
+    @return: a tuple
+    """
+    q_filters = tuple(repr(x) for x in q_filters or [])
+    kwargs_filters = tuple(sorted((k, _get_filter_value_signature(v)) for k, v in (kwargs_filters or {}).items()))
+    return q_filters, kwargs_filters
+
+
+def get_prefixed_q(q, prefix):
+    """
+    Returns a copy of the Q object with its lookups prefixed, so it can filter through a relation
+    @param q: a Q object
+    @param prefix: the relation path ex 'simplesales'
+    @return: a Q object
+    """
+    from django.db.models import Q
+    children = [get_prefixed_q(x, prefix) if isinstance(x, Q) else (f'{prefix}__{x[0]}', x[1]) for x in q.children]
+    return Q(*children, _connector=q.connector, _negated=q.negated)
+
+
 def get_foreign_keys(model):
     """
     Scans a model and return an Ordered Dictionary with the foreign keys found
@@ -49,3 +81,40 @@ def get_field_from_query_text(path, model):
             return field
         _rel = field.related_model
     return field
+
+
+def get_local_datetime(value):
+    """
+    Normalize a date or a datetime to a naive datetime in the current timezone, so values coming from different
+    sources (python, the database) can be compared.
+    @param value: a date or a datetime
+    @return: a naive datetime
+    """
+    import datetime
+    from django.utils import timezone
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value)
+    return value
+
+
+def is_truncation_boundary(value, kind):
+    """
+    Check if the value is exactly at the start of a truncation period (as in django.db.models.functions.Trunc)
+    @param value: a date or a datetime
+    @param kind: one of day, week, month, quarter, year
+    @return: bool
+    """
+    value = get_local_datetime(value)
+    if value.time() != value.time().min:
+        return False
+    if kind == 'week':
+        return value.weekday() == 0
+    if kind in ('month', 'quarter', 'year') and value.day != 1:
+        return False
+    if kind == 'quarter':
+        return value.month in (1, 4, 7, 10)
+    if kind == 'year':
+        return value.month == 1
+    return True
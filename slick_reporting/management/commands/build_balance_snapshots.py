@@ -0,0 +1,85 @@
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from ...fields import FirstBalanceField
+from ...registry import field_registry
+from ...snapshots import build_snapshots
+
+PERIODS = {
+    'monthly': relativedelta(months=1),
+    'quarterly': relativedelta(months=3),
+    'annually': relativedelta(years=1),
+}
+
+
+class Command(BaseCommand):
+    help = 'Build or refresh the balance snapshots used by the first balance computation fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('report_model', help='The report model as app_label.ModelName')
+        parser.add_argument('--date-field', required=True, help='The report model date field')
+        parser.add_argument('--group-by', default='', help='The group by field, if any')
+        parser.add_argument('--report-field', action='append', dest='report_fields',
+                            help='The first balance computation field name, defaults to __fb__. Can be repeated.')
+        parser.add_argument('--period', default='monthly', choices=list(PERIODS.keys()),
+                            help='The period between each snapshot')
+        parser.add_argument('--start-date', help='Date of the first snapshot (YYYY-MM-DD), defaults to the start of '
+                                                 'the period following the first record')
+        parser.add_argument('--end-date', help='No snapshots after this date (YYYY-MM-DD), defaults to today')
+
+    def parse_date(self, value):
+        try:
+            value = datetime.datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise CommandError(f'"{value}" is not a valid date, use the YYYY-MM-DD format')
+        return timezone.make_aware(value) if settings.USE_TZ else value
+
+    def get_start_date(self, report_model, date_field):
+        first_date = report_model.objects.aggregate(first_date=Min(date_field))['first_date']
+        if first_date is None:
+            return None
+        if isinstance(first_date, datetime.datetime):
+            first_date = timezone.make_naive(first_date) if timezone.is_aware(first_date) else first_date
+            first_date = first_date.date()
+        start_date = datetime.datetime(first_date.year, first_date.month, 1) + relativedelta(months=1)
+        return timezone.make_aware(start_date) if settings.USE_TZ else start_date
+
+    def handle(self, *args, **options):
+        try:
+            report_model = apps.get_model(options['report_model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        date_field = options['date_field']
+
+        report_fields = []
+        for name in options['report_fields'] or [FirstBalanceField.name]:
+            try:
+                klass = field_registry.get_field_by_name(name)
+            except KeyError as e:
+                raise CommandError(str(e))
+            if not issubclass(klass, FirstBalanceField):
+                raise CommandError(f'{name} is not a first balance field')
+            report_fields.append(klass(report_model=report_model, date_field=date_field,
+                                       group_by=options['group_by'] or None))
+
+        start_date = self.parse_date(options['start_date']) if options['start_date'] else \
+            self.get_start_date(report_model, date_field)
+        end_date = self.parse_date(options['end_date']) if options['end_date'] else timezone.now()
+        if not settings.USE_TZ and timezone.is_aware(end_date):
+            end_date = timezone.make_naive(end_date)
+
+        dates = []
+        date = start_date
+        while date is not None and date <= end_date:
+            dates.append(date)
+            date += PERIODS[options['period']]
+
+        for report_field in report_fields:
+            count = build_snapshots(report_field, dates)
+            self.stdout.write(f'{report_field.name}: {count} snapshots built on {len(dates)} dates')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...rollups import rollup_registry
+
+
+class Command(BaseCommand):
+    help = 'Refresh the registered rollups with the records created since their last refresh'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='The rollups names, defaults to all the registered rollups')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Drop and rebuild the rollups from all the records, needed when rolled up records '
+                                 'are changed or deleted, or when the rollup declaration changes')
+
+    def handle(self, *args, **options):
+        try:
+            rollups = [rollup_registry.get_rollup_by_name(x) for x in options['names']] or \
+                rollup_registry.get_all_rollups()
+        except KeyError as e:
+            raise CommandError(str(e))
+
+        for rollup in rollups:
+            count = rollup.refresh(rebuild=options['rebuild'])
+            self.stdout.write(f'{rollup.name}: {count} records rolled up')
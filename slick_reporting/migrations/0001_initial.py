@@ -0,0 +1,35 @@
+# Generated by Django 4.1.13 on 2026-10-16 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_field', models.CharField(max_length=255, verbose_name='report field')),
+                ('report_model', models.CharField(max_length=255, verbose_name='report model')),
+                ('date_field', models.CharField(max_length=255, verbose_name='date field')),
+                ('group_by', models.CharField(blank=True, default='', max_length=255, verbose_name='group by')),
+                ('group_value', models.CharField(blank=True, default='', max_length=255, verbose_name='group by value')),
+                ('date', models.DateTimeField(verbose_name='date')),
+                ('value', models.DecimalField(decimal_places=12, max_digits=36, null=True, verbose_name='value')),
+            ],
+            options={
+                'verbose_name': 'Balance snapshot',
+                'verbose_name_plural': 'Balance snapshots',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['report_field', 'report_model', 'date_field', 'group_by', 'date'], name='slick_repor_report__be8084_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.13 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slick_reporting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='name')),
+                ('high_water_mark', models.BigIntegerField(null=True, verbose_name='high-water mark')),
+                ('refreshed_at', models.DateTimeField(null=True, verbose_name='refreshed at')),
+            ],
+            options={
+                'verbose_name': 'Rollup state',
+                'verbose_name_plural': 'Rollup states',
+            },
+        ),
+    ]
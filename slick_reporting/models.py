@@ -0,0 +1,36 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Holds the balance of a first balance computation field, per group by value, for all the records before `date`.
+    Used by `FirstBalanceField` to compute balances starting from the nearest snapshot instead of the beginning of time.
+    """
+    report_field = models.CharField(_('report field'), max_length=255)
+    report_model = models.CharField(_('report model'), max_length=255)
+    date_field = models.CharField(_('date field'), max_length=255)
+    group_by = models.CharField(_('group by'), max_length=255, blank=True, default='')
+    group_value = models.CharField(_('group by value'), max_length=255, blank=True, default='')
+    date = models.DateTimeField(_('date'))
+    value = models.DecimalField(_('value'), max_digits=36, decimal_places=12, null=True)
+
+    class Meta:
+        verbose_name = _('Balance snapshot')
+        verbose_name_plural = _('Balance snapshots')
+        indexes = [
+            models.Index(fields=['report_field', 'report_model', 'date_field', 'group_by', 'date']),
+        ]
+
+
+class RollupState(models.Model):
+    """
+    Holds the high-water mark of a rollup: the primary key of the last report model record rolled up.
+    """
+    name = models.CharField(_('name'), max_length=255, unique=True)
+    high_water_mark = models.BigIntegerField(_('high-water mark'), null=True)
+    refreshed_at = models.DateTimeField(_('refreshed at'), null=True)
+
+    class Meta:
+        verbose_name = _('Rollup state')
+        verbose_name_plural = _('Rollup states')
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+
+from django.db import connections
+
+
+@contextmanager
+def null_context():
+    """
+    A context manager doing nothing, as `contextlib.nullcontext` needs python 3.7
+    """
+    yield
+
+
+class ReportProfile:
+    """
+    Collects the queries issued during a report run, attributed to the column (or computation fields) and the window
+    (normal, time_series or crosstab) they were issued for, along with the time spent in each of the report phases.
+    Queries not issued for a computation field, like the main queryset, are attributed to None.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.phases = OrderedDict()
+        self._local = threading.local()
+
+    @property
+    def _attributions(self):
+        if not hasattr(self._local, 'attributions'):
+            self._local.attributions = [(None, None)]
+        return self._local.attributions
+
+    @contextmanager
+    def capture(self):
+        """
+        Record the queries issued on the database connections inside the block.
+        Connections are per thread, threads issuing queries for the report must capture them as well.
+        """
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self._execute))
+            yield
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Add the time spent inside the block to the phase `name`
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    @contextmanager
+    def attribute(self, field, window):
+        """
+        Attribute the queries issued inside the block to the given field name & window
+        """
+        self._attributions.append((field, window))
+        try:
+            yield
+        finally:
+            self._attributions.pop()
+
+    def _execute(self, execute, sql, params, many, context):
+        field, window = self._attributions[-1]
+        query = {
+            'field': field,
+            'window': window,
+            'sql': sql,
+            'params': params if many or params is None else tuple(params),
+            'time': 0,
+            'rows': None,
+        }
+        self.queries.append(query)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            query['time'] = time.perf_counter() - start
+            self._count_rows(context['cursor'], query)
+
+    @staticmethod
+    def _count_rows(cursor, query):
+        """
+        Count the rows fetched from the cursor, or the affected rows if the query did not return any.
+        """
+        if cursor.description is None:
+            query['rows'] = cursor.rowcount if cursor.rowcount >= 0 else None
+            return
+
+        query['rows'] = 0
+
+        def count(fetch, many):
+            def wrapper(*args, **kwargs):
+                rows = fetch(*args, **kwargs)
+                if many:
+                    query['rows'] += len(rows)
+                elif rows is not None:
+                    query['rows'] += 1
+                return rows
+
+            return wrapper
+
+        cursor.fetchone = count(cursor.fetchone, False)
+        cursor.fetchmany = count(cursor.fetchmany, True)
+        cursor.fetchall = count(cursor.fetchall, True)
+
+    def get_fields_summary(self):
+        """
+        Get the number of queries, their time and rows per field & window, slowest first
+        :return: a list of dicts
+        """
+        summary = OrderedDict()
+        for query in self.queries:
+            key = query['field'], query['window']
+            entry = summary.setdefault(key, {'field': key[0], 'window': key[1], 'queries': 0, 'time': 0, 'rows': 0})
+            entry['queries'] += 1
+            entry['time'] += query['time']
+            entry['rows'] += query['rows'] or 0
+        return sorted(summary.values(), key=lambda x: x['time'], reverse=True)
+
+    def as_dict(self):
+        return {
+            'query_count': len(self.queries),
+            'query_time': sum(x['time'] for x in self.queries),
+            'phases': dict(self.phases),
+            'fields': self.get_fields_summary(),
+            'queries': self.queries,
+        }
@@ -44,3 +44,56 @@ class ReportFieldRegistry(object):
 
 
 field_registry = ReportFieldRegistry()
+
+
+class ForeignKeyLookupRegistry(object):
+    """
+    Holds the foreign keys which related records can be looked up by `ForeignKeyLookupView`. Nothing is exposed unless
+    registered here explicitly, ie in your app `ready()`:
+
+        lookup_registry.register(Sales._meta.get_field('product'), search_fields=['name', 'sku'])
+    """
+
+    def __init__(self):
+        super(ForeignKeyLookupRegistry, self).__init__()
+        self._registry = {}
+
+    @staticmethod
+    def get_key(foreign_key):
+        """
+        :return: the lookup key of a foreign key, ex 'app_label.model_name.field_name'
+        """
+        return f'{foreign_key.model._meta.label_lower}.{foreign_key.name}'
+
+    def register(self, foreign_key, search_fields=None):
+        """
+        Expose the records related by a foreign key to the lookup, overriding the previous registration if any
+        :param foreign_key: the model field
+        :param search_fields: the related model fields searched by the lookup term, if None no record matches a term
+        and the records can only be browsed page by page
+        :return: the lookup key
+        """
+        key = self.get_key(foreign_key)
+        self._registry[key] = foreign_key, list(search_fields or [])
+        return key
+
+    def unregister(self, key):
+        if key not in self._registry:
+            raise NotRegistered(key)
+        del self._registry[key]
+
+    def is_registered(self, foreign_key):
+        return self.get_key(foreign_key) in self._registry
+
+    def get_foreign_key(self, key):
+        if key in self._registry:
+            return self._registry[key][0]
+        raise KeyError(f'{key} is not found in the foreign key lookup registry')
+
+    def get_search_fields(self, key):
+        if key in self._registry:
+            return self._registry[key][1]
+        raise KeyError(f'{key} is not found in the foreign key lookup registry')
+
+
+lookup_registry = ForeignKeyLookupRegistry()
@@ -0,0 +1,400 @@
+import hashlib
+
+from django.apps.registry import Apps
+from django.contrib.admin.sites import AlreadyRegistered, NotRegistered
+from django.db import connections, models, router, transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Trunc
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .helpers import is_truncation_boundary
+
+rollup_apps = Apps()
+"""The apps registry of the rollup models, kept apart from the project models so they are never migrated"""
+
+
+class Rollup(object):
+    """
+    Declares a daily rollup of the report_model: the records summed per day (of the `date_field`) and per the
+    `dimensions` foreign keys, materialized into a generated table by the `refresh_rollups` management command.
+    Once refreshed, the computation fields which can be answered from the rollup are computed on it, plus the records
+    added after its last refresh. A rolled up record saved or deleted invalidates the rollup until its next refresh.
+
+    @rollup_register
+    class DailySales(Rollup):
+        report_model = SimpleSales
+        date_field = 'doc_date'
+        dimensions = ['client', 'product']
+        measures = ['quantity', 'value']
+    """
+
+    name = ''
+    """The rollup name, used for its table name. Defaults to the lower cased class name"""
+
+    report_model = None
+    date_field = ''
+    """The report_model date field, truncated to the day"""
+
+    dimensions = None
+    """A list of the report_model foreign keys names to sum per"""
+
+    measures = None
+    """A list of the report_model numeric fields to sum"""
+
+    count_field = 'record_count'
+    """The rollup field holding the number of records, used for the Count computation fields"""
+
+    batch_size = 1000
+
+    def __init__(self):
+        self.name = self.name or type(self).__name__.lower()
+        self.dimensions = list(self.dimensions or [])
+        self.measures = list(self.measures or [])
+        self._model = None
+
+    @property
+    def db_table(self):
+        return f'slick_reporting_rollup_{self.name}'
+
+    def get_model(self):
+        """
+        Get the model of the rollup table, created on first access in `rollup_apps`
+        """
+        if self._model is None:
+            self._model = self._create_model()
+        return self._model
+
+    def _create_model(self):
+        opts = self.report_model._meta
+        attrs = {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {'apps': rollup_apps, 'app_label': 'slick_reporting', 'db_table': self.db_table}),
+            'id': models.BigAutoField(primary_key=True),
+            self.date_field: self._get_date_field(opts.get_field(self.date_field)),
+            self.count_field: models.BigIntegerField(default=0),
+        }
+        for name in self.dimensions:
+            attrs[name] = self._get_dimension_field(opts.get_field(name))
+        for name in self.measures:
+            attrs[name] = self._get_measure_field(opts.get_field(name))
+        # the model name has to be unique in the registry, the hash keeps it within the identifiers limits
+        model_name = f'Rollup{hashlib.md5(self.db_table.encode()).hexdigest()[:12]}'
+        # a rollup declared again replaces the model of the previous declaration
+        rollup_apps.all_models['slick_reporting'].pop(model_name.lower(), None)
+        rollup_apps.clear_cache()
+        return type(model_name, (models.Model,), attrs)
+
+    @staticmethod
+    def _get_date_field(field):
+        if isinstance(field, models.DateTimeField):
+            return models.DateTimeField(db_index=True)
+        return models.DateField(db_index=True)
+
+    @staticmethod
+    def _get_dimension_field(field):
+        """
+        A foreign key is held as a plain column of its target type, named as the foreign key so the report field
+        lookups and group by apply as is.
+        """
+        target = field.target_field
+        if isinstance(target, models.BigAutoField):
+            klass, kwargs = models.BigIntegerField, {}
+        # no SmallAutoField before Django 3.0
+        elif isinstance(target, getattr(models, 'SmallAutoField', ())):
+            klass, kwargs = models.SmallIntegerField, {}
+        elif isinstance(target, models.AutoField):
+            klass, kwargs = models.IntegerField, {}
+        else:
+            klass = type(target)
+            kwargs = {x: getattr(target, x) for x in ('max_length', 'max_digits', 'decimal_places')
+                      if getattr(target, x, None) is not None}
+        return klass(db_column=field.column, null=True, db_index=True, **kwargs)
+
+    @staticmethod
+    def _get_measure_field(field):
+        if isinstance(field, models.DecimalField):
+            # room for the sums
+            return models.DecimalField(max_digits=field.max_digits + 10, decimal_places=field.decimal_places,
+                                       null=True)
+        if isinstance(field, models.FloatField):
+            return models.FloatField(null=True)
+        return models.BigIntegerField(null=True)
+
+    def _get_connection(self):
+        return connections[router.db_for_write(self.report_model)]
+
+    def table_exists(self):
+        connection = self._get_connection()
+        with connection.cursor() as cursor:
+            return self.db_table in connection.introspection.table_names(cursor)
+
+    def create_table(self):
+        with self._get_connection().schema_editor() as schema_editor:
+            schema_editor.create_model(self.get_model())
+
+    def drop_table(self):
+        with self._get_connection().schema_editor() as schema_editor:
+            schema_editor.delete_model(self.get_model())
+
+    def get_state(self, states=None):
+        """
+        :param states: a dict of the states already loaded by rollup name, the state is loaded only if missing there
+        :return: the RollupState of this rollup, or None if it was never refreshed
+        """
+        from .models import RollupState
+        if states is None:
+            return RollupState.objects.filter(name=self.name).first()
+        if self.name not in states:
+            states[self.name] = RollupState.objects.filter(name=self.name).first()
+        return states[self.name]
+
+    def is_refreshed(self, states=None):
+        """
+        :param states: see `get_state`
+        :return: True if the rollup was refreshed and not invalidated since
+        """
+        state = self.get_state(states)
+        return state is not None and state.high_water_mark is not None
+
+    def invalidate(self, record):
+        """
+        Invalidate the rollup if the record was rolled up, it's then not used until rebuilt by the next refresh.
+        :param record: a report_model instance saved or deleted
+        """
+        from .models import RollupState
+        if record.pk is not None:
+            RollupState.objects.filter(name=self.name, high_water_mark__gte=record.pk).update(high_water_mark=None)
+
+    def refresh(self, rebuild=False):
+        """
+        Add the records created since the last refresh to the rollup, creating its table if needed.
+        The records are tracked by their primary key: a record committed with a primary key lower than the high-water
+        mark, or changed by `QuerySet.update` & the bulk methods (which send no signals), is only accounted for after a
+        rebuild. A rollup invalidated by a record saved or deleted is rebuilt.
+        :param rebuild: drop and rebuild the rollup from all the records
+        :return: the number of records rolled up
+        """
+        from .models import RollupState
+        if not rebuild:
+            rebuild = not self.is_refreshed()
+        if rebuild and self.table_exists():
+            self.drop_table()
+        if not self.table_exists():
+            self.create_table()
+            rebuild = True
+
+        with transaction.atomic():
+            state, created = RollupState.objects.select_for_update().get_or_create(name=self.name)
+            high_water_mark = None if rebuild else state.high_water_mark
+            new_high_water_mark = self.report_model.objects.aggregate(pk=Max('pk'))['pk']
+
+            records = self.report_model.objects.order_by().filter(pk__lte=new_high_water_mark or 0)
+            if high_water_mark is not None:
+                records = records.filter(pk__gt=high_water_mark)
+            count = self._roll_up(records, existing=high_water_mark is not None)
+
+            state.high_water_mark = new_high_water_mark
+            state.refreshed_at = timezone.now()
+            state.save()
+        return count
+
+    def _roll_up(self, records, existing):
+        """
+        Sum the records per day & dimensions into the rollup table
+        :param records: the report_model queryset to add to the rollup
+        :param existing: if True, the sums are added to the existing rollup rows
+        :return: the number of records rolled up
+        """
+        model = self.get_model()
+        records = records.filter(**{f'{self.date_field}__isnull': False})
+        dimensions_columns = [self.report_model._meta.get_field(x).attname for x in self.dimensions]
+        aggregates = {x: Sum(x) for x in self.measures}
+        aggregates[self.count_field] = Count('pk')
+        rows = records.annotate(rollup_day=Trunc(self.date_field, 'day')).values(
+            'rollup_day', *dimensions_columns).annotate(**aggregates)
+
+        instances = {}
+        count = 0
+        for row in rows.iterator():
+            count += row[self.count_field]
+            key = (row['rollup_day'],) + tuple(row[x] for x in dimensions_columns)
+            values = {x: row[x] for x in self.measures}
+            values[self.count_field] = row[self.count_field]
+            instances[key] = model(**{self.date_field: row['rollup_day']},
+                                   **dict(zip(self.dimensions, key[1:])), **values)
+        if not instances:
+            return count
+
+        updated = []
+        if existing:
+            days = [x[0] for x in instances]
+            queryset = model.objects.filter(**{f'{self.date_field}__range': (min(days), max(days))})
+            for instance in queryset.iterator():
+                key = (getattr(instance, self.date_field),) + tuple(getattr(instance, x) for x in self.dimensions)
+                new_instance = instances.pop(key, None)
+                if new_instance is None:
+                    continue
+                for name in self.measures + [self.count_field]:
+                    value = getattr(new_instance, name)
+                    if value is not None:
+                        setattr(instance, name, (getattr(instance, name) or 0) + value)
+                updated.append(instance)
+
+        model.objects.bulk_update(updated, self.measures + [self.count_field], batch_size=self.batch_size)
+        model.objects.bulk_create(instances.values(), batch_size=self.batch_size)
+        return count
+
+    def get_measure(self, report_field):
+        """
+        Get the rollup field the report field calculation is summed from
+        :return: the field name or None if the calculation is not a sum of a measure or a count of records
+        """
+        calculation_field = report_field.calculation_field
+        if report_field.calculation_method is Sum and calculation_field in self.measures:
+            return calculation_field
+        if report_field.calculation_method is Count and \
+                calculation_field in ('pk', self.report_model._meta.pk.name):
+            return self.count_field
+        return None
+
+    def get_rollup_filters(self, kwargs_filters):
+        """
+        Translate the report field filters to the rollup ones
+        :param kwargs_filters: the report field filters, after `prepare_filters`
+        :return: a dict of filters or None if the rollup can not apply them
+        """
+        opts = self.report_model._meta
+        dimensions = {}
+        for name in self.dimensions:
+            dimensions[name] = dimensions[opts.get_field(name).attname] = name
+
+        filters = {}
+        for lookup, value in (kwargs_filters or {}).items():
+            name, _, lookup_type = lookup.partition('__')
+            if name == self.date_field:
+                # the rollup holds whole days
+                if lookup_type not in ('gte', 'lt') or value is None or not is_truncation_boundary(value, 'day'):
+                    return None
+                filters[lookup] = value
+            elif name in dimensions and lookup_type in ('', 'in'):
+                if lookup_type:
+                    filters[f'{dimensions[name]}__in'] = [getattr(x, 'pk', x) for x in value]
+                else:
+                    filters[dimensions[name]] = getattr(value, 'pk', value)
+            else:
+                return None
+        if not any(x.startswith(f'{self.date_field}__') for x in filters):
+            # records without a date are not rolled up
+            return None
+        return filters
+
+    def can_answer(self, report_field, q_filters=None, kwargs_filters=None):
+        """
+        Check if the report field calculation can be computed from this rollup
+        :param report_field: a SlickReportField instance
+        :param q_filters: the filters, after `prepare_filters`
+        :param kwargs_filters: the filters, after `prepare_filters`
+        :return: bool
+        """
+        group_by = '' if report_field.prevent_group_by else (report_field.group_by or '')
+        return report_field.report_model is self.report_model and report_field.date_field == self.date_field and \
+            not (q_filters or report_field.plus_side_q or report_field.minus_side_q) and \
+            not (report_field.base_q_filters or report_field.base_kwargs_filters) and \
+            report_field.has_default_aggregation() and self.get_measure(report_field) is not None and \
+            (not group_by or group_by in self.dimensions) and \
+            self.get_rollup_filters(kwargs_filters) is not None
+
+    def get_results(self, report_field, kwargs_filters):
+        """
+        Compute the report field calculation from the rollup, plus the records added after its last refresh.
+        :param report_field: a SlickReportField instance the rollup `can_answer`
+        :param kwargs_filters: the filters, after `prepare_filters`
+        :return: a tuple of (debit_results, credit_results) like `prepare`, or None if the rollup is not refreshed
+        """
+        state = self.get_state(report_field.rollup_states)
+        if state is None or state.high_water_mark is None:
+            return None
+
+        group_by = '' if report_field.prevent_group_by else (report_field.group_by or '')
+        annotation = report_field.get_annotation_name()
+        queryset = self.get_model().objects.filter(**self.get_rollup_filters(kwargs_filters))
+        aggregate = {annotation: Sum(self.get_measure(report_field))}
+        if group_by:
+            rolled = {x[group_by]: x[annotation] for x in queryset.values(group_by).annotate(**aggregate)}
+        else:
+            rolled = {None: queryset.aggregate(**aggregate)[annotation]}
+
+        recent = report_field.get_queryset().filter(pk__gt=state.high_water_mark, **kwargs_filters)
+        recent = report_field.apply_aggregation(recent, group_by)
+        recent = {x[group_by]: x[annotation] for x in recent} if group_by else {None: recent[annotation]}
+        for key, value in recent.items():
+            if value is not None:
+                rolled[key] = (rolled.get(key) or 0) + value
+
+        if report_field.calculation_method is Count:
+            rolled = {key: value or 0 for key, value in rolled.items()}
+        if group_by:
+            results = [{group_by: key, annotation: value} for key, value in rolled.items()]
+        else:
+            results = {annotation: rolled[None]}
+        # without sides, the credit is computed by the same query as the debit
+        return results, results if report_field._debit_and_credit else None
+
+
+class RollupRegistry(object):
+    def __init__(self):
+        super(RollupRegistry, self).__init__()
+        self._registry = {}
+
+    def register(self, rollup_class, override=False):
+        """
+        Register a rollup into the registry
+        :param rollup_class: a Rollup subclass
+        :param override: if True, a rollup will get replaced if found, else it would throw an AlreadyRegistered
+        :return: the rollup_class passed
+        """
+        rollup = rollup_class()
+        if rollup.name in self._registry and not override:
+            raise AlreadyRegistered(f'The rollup name {rollup.name} is used before and `override` is False')
+        self._registry[rollup.name] = rollup
+        for signal in (post_save, post_delete):
+            signal.connect(_invalidate_rollups, sender=rollup.report_model,
+                           dispatch_uid=f'slick_reporting_rollups_{rollup.report_model._meta.label_lower}')
+        return rollup_class
+
+    def unregister(self, name):
+        if name not in self._registry:
+            raise NotRegistered(name)
+        del self._registry[name]
+
+    def get_rollup_by_name(self, name):
+        if name in self._registry:
+            return self._registry[name]
+        raise KeyError(f'{name} is not found in the rollup registry. Options are {",".join(self._registry.keys())}')
+
+    def get_all_rollups(self):
+        return list(self._registry.values())
+
+    def get_rollup(self, report_field, q_filters=None, kwargs_filters=None):
+        """
+        Get a refreshed rollup the report field calculation can be computed from
+        :param report_field: a SlickReportField instance
+        :param q_filters: the filters, after `prepare_filters`
+        :param kwargs_filters: the filters, after `prepare_filters`
+        :return: a Rollup instance or None
+        """
+        for rollup in self._registry.values():
+            if rollup.can_answer(report_field, q_filters, kwargs_filters) and \
+                    rollup.is_refreshed(report_field.rollup_states):
+                return rollup
+        return None
+
+
+rollup_registry = RollupRegistry()
+
+
+def _invalidate_rollups(sender, instance, **kwargs):
+    for rollup in rollup_registry.get_all_rollups():
+        if rollup.report_model is sender:
+            rollup.invalidate(instance)
@@ -0,0 +1,148 @@
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, Max
+
+from .helpers import get_field_from_query_text
+
+
+def get_snapshot_identity(report_field):
+    """
+    Get the lookups identifying the snapshots of a report field
+    :param report_field: a FirstBalanceField instance
+    :return: a dict to be used with BalanceSnapshot.objects.filter(**returned_value)
+    """
+    return {
+        'report_field': report_field.name,
+        'report_model': report_field.report_model._meta.label_lower,
+        'date_field': report_field.date_field,
+        'group_by': '' if report_field.prevent_group_by else (report_field.group_by or ''),
+    }
+
+
+def _normalize_value(report_field, value):
+    """
+    Snapshot values are stored with a large precision, bring them back to the type of the computation results.
+    """
+    if value is None:
+        return None
+    if issubclass(report_field.calculation_method, Count):
+        return int(value)
+    model_field = get_field_from_query_text(report_field.calculation_field, report_field.report_model)
+    if isinstance(model_field, models.DecimalField):
+        return Decimal(value).quantize(Decimal(1).scaleb(-model_field.decimal_places))
+    if isinstance(model_field, models.IntegerField):
+        return int(value)
+    if isinstance(model_field, models.FloatField):
+        return float(value)
+    return value
+
+
+def _pop_group_filters(report_field, group_by, kwargs_filters):
+    """
+    Pop the filters on the group by field out of kwargs_filters
+    :return: a tuple of (the popped filters, the list of the filtered group values as strings or None if all)
+    """
+    names = {group_by}
+    if '__' not in group_by:
+        names.add(report_field.report_model._meta.get_field(group_by).attname)
+
+    group_filters = {}
+    group_values = None
+    for name in names:
+        for lookup in [name, f'{name}__in']:
+            if lookup not in kwargs_filters:
+                continue
+            value = kwargs_filters.pop(lookup)
+            group_filters[lookup] = value
+            values = value if lookup.endswith('__in') else [value]
+            values = {str(getattr(x, 'pk', x)) for x in values}
+            group_values = values if group_values is None else group_values & values
+    return group_filters, group_values
+
+
+def get_snapshot_results(report_field, q_filters=None, kwargs_filters=None):
+    """
+    Compute the first balance starting from the nearest snapshot.
+    Snapshots can only answer a field without plus & minus sides, filtered only by date and the group by field.
+    :param report_field: a FirstBalanceField instance
+    :param q_filters:
+    :param kwargs_filters:
+    :return: a tuple of (debit_results, credit_results) like `prepare`, or None if no snapshot can be used.
+    """
+    if q_filters or report_field._debit_and_credit:
+        return None
+    q_filters, kwargs_filters = report_field.prepare_filters(q_filters, kwargs_filters)
+    kwargs_filters = dict(kwargs_filters or {})
+    date_lookup = f'{report_field.date_field}__lt'
+    before = kwargs_filters.pop(date_lookup, None)
+    if q_filters or before is None:
+        return None
+
+    from .models import BalanceSnapshot
+    identity = get_snapshot_identity(report_field)
+    group_by = identity['group_by']
+    group_filters, group_values = _pop_group_filters(report_field, group_by, kwargs_filters) if group_by else ({}, None)
+    if kwargs_filters:
+        # Other filters are not accounted for in the snapshots
+        return None
+
+    snapshots = BalanceSnapshot.objects.filter(**identity)
+    snapshot_date = snapshots.filter(date__lte=before).aggregate(date=Max('date'))['date']
+    if snapshot_date is None:
+        return None
+    snapshots = snapshots.filter(date=snapshot_date)
+    if group_values is not None:
+        snapshots = snapshots.filter(group_value__in=group_values)
+    balances = dict(snapshots.values_list('group_value', 'value'))
+
+    annotation = report_field.get_annotation_name()
+    queryset = report_field.get_queryset().filter(**{f'{report_field.date_field}__gte': snapshot_date,
+                                                     date_lookup: before}, **group_filters)
+    movement = report_field.apply_aggregation(queryset, group_by)
+    movement = {str(x[group_by]): x[annotation] for x in movement} if group_by else {'': movement[annotation]}
+    for key, value in movement.items():
+        if value is not None:
+            balances[key] = (balances.get(key) or 0) + value
+
+    balances = {key: _normalize_value(report_field, value) for key, value in balances.items()}
+    if group_by:
+        return [{group_by: key, annotation: value} for key, value in balances.items()], None
+    return {annotation: balances.get('')}, None
+
+
+def build_snapshots(report_field, dates):
+    """
+    Build (or refresh) the snapshots of a first balance field at each of the given dates.
+    The existing snapshots of the field on or after the first date are replaced.
+    :param report_field: a FirstBalanceField instance, with its report_model, date_field and group_by set
+    :param dates: a list of dates, the snapshot at a date holds the balance of the records before it
+    :return: the number of snapshots created
+    """
+    from .models import BalanceSnapshot
+    identity = get_snapshot_identity(report_field)
+    group_by = identity['group_by']
+    annotation = report_field.get_annotation_name()
+    dates = sorted(dates)
+
+    balances = {}
+    snapshots = []
+    previous_date = None
+    for date in dates:
+        filters = {f'{report_field.date_field}__lt': date}
+        if previous_date:
+            filters[f'{report_field.date_field}__gte'] = previous_date
+        movement = report_field.apply_aggregation(report_field.get_queryset().filter(**filters), group_by)
+        movement = {str(x[group_by]): x[annotation] for x in movement} if group_by else {'': movement[annotation]}
+        for key, value in movement.items():
+            if value is not None:
+                balances[key] = balances.get(key, 0) + value
+        snapshots += [BalanceSnapshot(group_value=key, date=date, value=value, **identity)
+                      for key, value in balances.items()]
+        previous_date = date
+
+    with transaction.atomic():
+        if dates:
+            BalanceSnapshot.objects.filter(date__gte=dates[0], **identity).delete()
+        BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
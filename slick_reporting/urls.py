@@ -0,0 +1,7 @@
+from django.urls import path
+
+from .views import ForeignKeyLookupView
+
+urlpatterns = [
+    path('lookup/<str:lookup_key>/', ForeignKeyLookupView.as_view(), name='slick_reporting_lookup'),
+]
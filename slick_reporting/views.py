@@ -1,16 +1,44 @@
+import csv
 import datetime
+import tempfile
 
 import simplejson as json
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
-from django.http import HttpResponse
+from django.contrib.auth import get_permission_codename
+from django.core.exceptions import EmptyResultSet, ImproperlyConfigured, PermissionDenied, SuspiciousOperation
+from django.db.models import Q, QuerySet
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, \
+    StreamingHttpResponse
 from django.utils.encoding import force_str
 from django.utils.functional import Promise
-from django.views.generic import FormView
+from django.views.generic import FormView, View
 
 from .app_settings import SLICK_REPORTING_DEFAULT_END_DATE, SLICK_REPORTING_DEFAULT_START_DATE, \
     SLICK_REPORTING_DEFAULT_CHARTS_ENGINE
+from .cache import ReportResultCache, track_model
 from .form_factory import report_form_factory
 from .generator import ReportGenerator
+from .helpers import get_field_from_query_text
+from .registry import lookup_registry
+
+
+def json_default(obj):
+    if type(obj) is datetime.datetime:
+        return obj.strftime('%Y-%m-%d %H:%M')
+    elif hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    elif isinstance(obj, Promise):
+        return force_str(obj)
+
+
+class Echo:
+    """
+    A file like object which returns what is written to it, to stream the csv writer output.
+    """
+
+    def write(self, value):
+        return value
 
 
 class SlickReportViewBase(FormView):
@@ -46,20 +74,200 @@ class SlickReportViewBase(FormView):
     
     """
 
+    cache_timeout = None
+    """If set, the report results are cached for that many seconds, keyed by the report slug, the form cleaned data
+    and the columns configuration"""
+
+    result_cache_class = ReportResultCache
+    """The class caching the report results"""
+
+    export_parameter = '_export'
+    """The request parameter selecting the export format"""
+
+    export_formats = ['csv', 'ndjson', 'xlsx']
+    """The allowed export formats, each handled by the `export_<format>` method"""
+
+    profile_report = False
+    """If True, the report run is profiled, and the profile is added to the ajax response when settings.DEBUG is True"""
+
+    having = None
+    """A dict filtering the groups by their computation fields values, see `ReportGenerator.having`"""
+
+    show_empty_records = None
+    """Include the group by model records without any report_model record, see `ReportGenerator.show_empty_records`"""
+
+    datatables_server_side = False
+    """If True, the report table is paginated and ordered on the server (DataTables server-side processing), only the
+    rows of the requested page are computed. The charts are drawn from the first page rows."""
+
+    datatables_page_length = 10
+    """The number of rows of the first page, when `datatables_server_side` is set"""
+
+    lazy_foreign_keys = None
+    """A list of the form foreign keys (or True for all of them) rendered with a lazy widget: only the selected options
+    are rendered, the others are looked up as the user types from `ForeignKeyLookupView`.
+    Needs `slick_reporting.urls` to be included."""
+
+    cache_form_class = True
+    """If True, the form class built by `report_form_factory` is cached per view class and form configuration, see
+    `get_form_class_cache_key` and `clear_form_class_cache`"""
+
+    _form_classes = {}
+
     template_name = 'slick_reporting/simple_report.html'
 
+    page = None
+
     def get(self, request, *args, **kwargs):
         form_class = self.get_form_class()
         self.form = self.get_form(form_class)
         if self.form.is_valid():
+            export_format = request.GET.get(self.export_parameter)
+            if export_format:
+                return self.export_to_response(export_format)
+
+            self.page = self.get_page()
             report_data = self.get_report_results()
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                if self.datatables_server_side and 'draw' in request.GET:
+                    return self.ajax_render_to_response(self.get_datatables_data(report_data))
                 return self.ajax_render_to_response(report_data)
 
             return self.render_to_response(self.get_context_data(report_data=report_data))
 
         return self.render_to_response(self.get_context_data())
 
+    def get_page(self):
+        """
+        Get the page of the report to compute when `datatables_server_side` is set, from the DataTables server-side
+        processing parameters (start, length, order and columns), defaulting to the first page.
+        :return: a dict of the report generator `page_offset`, `page_length` and `order_by`, or None for all the rows
+        """
+        if not self.datatables_server_side:
+            return None
+        params = self.request.GET
+        try:
+            page_offset = max(int(params.get('start', 0)), 0)
+            page_length = int(params.get('length', self.datatables_page_length))
+        except ValueError:
+            raise SuspiciousOperation('Invalid page parameters')
+
+        order_by = []
+        index = 0
+        while f'order[{index}][column]' in params:
+            column = params.get(f'columns[{params[f"order[{index}][column]"]}][data]')
+            if column:
+                order_by.append(f'-{column}' if params.get(f'order[{index}][dir]') == 'desc' else column)
+            index += 1
+        return {
+            'page_offset': page_offset,
+            # -1 is all the rows
+            'page_length': page_length if page_length >= 0 else None,
+            'order_by': order_by,
+        }
+
+    @staticmethod
+    def get_records_filtered(report_generator, data):
+        """
+        Get the number of records over all the pages
+        :param report_generator: the report generator which computed the page
+        :param data: the page data, before `filter_results`
+        """
+        if report_generator.records_filtered is None:
+            # all the rows were requested (DataTables length -1), the page holds them all
+            return len(data)
+        return report_generator.records_filtered
+
+    def get_datatables_data(self, report_data):
+        """
+        Get the DataTables server-side processing response out of the report results
+        """
+        try:
+            draw = int(self.request.GET['draw'])
+        except ValueError:
+            raise SuspiciousOperation('Invalid draw parameter')
+        return {
+            'draw': draw,
+            # there is no search, all the records are the filtered records
+            'recordsTotal': report_data['records_filtered'],
+            'recordsFiltered': report_data['records_filtered'],
+            'data': report_data['data'],
+        }
+
+    def export_to_response(self, export_format):
+        """
+        Return a streaming response of the report exported in the `export_format`, one of `export_formats`.
+        The rows are streamed as the report generator produces them.
+        """
+        if export_format not in self.export_formats:
+            return HttpResponseBadRequest(f'Unsupported export format: {export_format}')
+
+        report_generator = self.get_report_generator(self.get_queryset(), False)
+        columns = report_generator.get_columns_data()
+        rows = self.get_export_rows(report_generator)
+        response = getattr(self, f'export_{export_format}')(columns, rows)
+        response['Content-Disposition'] = f'attachment; filename="{self.get_report_slug()}.{export_format}"'
+        return response
+
+    def get_export_rows(self, report_generator):
+        """
+        Get the rows to export, an iterator computing them as the response is streamed
+        """
+        rows = report_generator.iter_report_data()
+        if type(self).filter_results is not SlickReportViewBase.filter_results:
+            # filter_results expects the whole results list
+            rows = self.filter_results(list(rows), False)
+        return rows
+
+    def export_csv(self, columns, rows):
+        writer = csv.writer(Echo())
+        names = [col['name'] for col in columns]
+
+        def get_lines():
+            yield writer.writerow([force_str(col['verbose_name']) for col in columns])
+            for row in rows:
+                yield writer.writerow(['' if row.get(name) is None else row.get(name) for name in names])
+
+        return StreamingHttpResponse(get_lines(), content_type='text/csv')
+
+    def export_ndjson(self, columns, rows):
+        def get_lines():
+            for row in rows:
+                yield json.dumps(row, use_decimal=True, default=json_default) + '\n'
+
+        return StreamingHttpResponse(get_lines(), content_type='application/x-ndjson')
+
+    def export_xlsx(self, columns, rows):
+        """
+        Export the rows with an openpyxl write only workbook.
+        The workbook is not streamed, it is written in full to a temporary file which is then served.
+        """
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise ImproperlyConfigured('openpyxl is required to export to xlsx, install django-slick-reporting[xlsx]')
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        names = [col['name'] for col in columns]
+        sheet.append([force_str(col['verbose_name']) for col in columns])
+        for row in rows:
+            sheet.append([self._get_xlsx_value(row.get(name)) for name in names])
+
+        file = tempfile.TemporaryFile()
+        workbook.save(file)
+        file.seek(0)
+        return FileResponse(file, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    @staticmethod
+    def _get_xlsx_value(value):
+        if isinstance(value, Promise):
+            return force_str(value)
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            # Excel does not support timezones
+            return value.replace(tzinfo=None)
+        return value
+
     @classmethod
     def get_report_model(cls):
         return cls.report_model or cls.queryset.model
@@ -71,38 +279,62 @@ class SlickReportViewBase(FormView):
     def serialize_to_json(self, response_data):
         """ Returns the JSON string for the compiled data object. """
 
-        def date_handler(obj):
-            if type(obj) is datetime.datetime:
-                return obj.strftime('%Y-%m-%d %H:%M')
-            elif hasattr(obj, 'isoformat'):
-                return obj.isoformat()
-            elif isinstance(obj, Promise):
-                return force_str(obj)
-
         indent = None
         if settings.DEBUG:
             indent = 4
 
-        return json.dumps(response_data, indent=indent, use_decimal=True, default=date_handler)
+        return json.dumps(response_data, indent=indent, use_decimal=True, default=json_default)
 
     def get_form_class(self):
         """
         Automatically instantiate a form based on details provided
         :return:
         """
-        return self.form_class or report_form_factory(self.get_report_model(), crosstab_model=self.crosstab_model,
-                                                      display_compute_reminder=self.crosstab_compute_reminder,
-                                                      excluded_fields=self.excluded_fields,
-                                                      initial=self.get_form_initial(),
-                                                      # required=self.required_fields
-                                                      )
+        if self.form_class:
+            return self.form_class
+        key = self.get_form_class_cache_key() if self.cache_form_class else None
+        if key is not None:
+            key = type(self), key
+        form_class = SlickReportViewBase._form_classes.get(key) if key is not None else None
+        if form_class is None:
+            form_class = report_form_factory(self.get_report_model(), crosstab_model=self.crosstab_model,
+                                             display_compute_reminder=self.crosstab_compute_reminder,
+                                             excluded_fields=self.excluded_fields,
+                                             initial=self.get_form_initial(),
+                                             lazy_foreign_keys=self.lazy_foreign_keys,
+                                             # required=self.required_fields
+                                             )
+            if key is not None:
+                SlickReportViewBase._form_classes[key] = form_class
+        return form_class
+
+    def get_form_class_cache_key(self):
+        """
+        Get the key the form class is cached by (along with the view class), override if the form depends on
+        something else.
+        :return: a hashable key, or None not to cache the form class
+        """
+        # the initial is left out, as it may change on each request (ie: today), it is passed to the form instead
+        return (self.get_report_model(), self.crosstab_model, self.crosstab_compute_reminder,
+                tuple(self.excluded_fields or []),
+                self.lazy_foreign_keys if type(self.lazy_foreign_keys) is bool else tuple(self.lazy_foreign_keys or []))
+
+    @classmethod
+    def clear_form_class_cache(cls):
+        """
+        Clear the form classes cached for this view class and its subclasses, ie when the report model foreign keys
+        changed.
+        """
+        for view_class, key in list(SlickReportViewBase._form_classes):
+            if issubclass(view_class, cls):
+                SlickReportViewBase._form_classes.pop((view_class, key), None)
 
     def get_form_kwargs(self):
         """
         Returns the keyword arguments for instantiating the form.
         """
         kwargs = {
-            'initial': self.get_initial(),
+            'initial': dict(self.get_form_initial(), **self.get_initial()),
             'prefix': self.get_prefix(),
         }
 
@@ -120,7 +352,7 @@ class SlickReportViewBase(FormView):
             })
         return kwargs
 
-    def get_report_generator(self, queryset, for_print):
+    def get_report_generator(self, queryset, for_print, **kwargs):
         q_filters, kw_filters = self.form.get_filters()
         if self.crosstab_model:
             self.crosstab_ids = self.form.get_crosstab_ids()
@@ -147,7 +379,11 @@ class SlickReportViewBase(FormView):
                                            crosstab_columns=self.crosstab_columns,
                                            crosstab_compute_reminder=crosstab_compute_reminder,
 
-                                           format_row_func=self.format_row
+                                           having=self.having,
+                                           show_empty_records=self.show_empty_records,
+                                           format_row_func=self.format_row,
+                                           profile_report=self.profile_report,
+                                           **kwargs
                                            )
 
     def format_row(self, row_obj):
@@ -169,18 +405,78 @@ class SlickReportViewBase(FormView):
 
     def get_report_results(self, for_print=False):
         """
-        Gets the reports Data, and, its meta data used by datatables.net and highcharts
+        Gets the reports Data, and, its meta data used by datatables.net and highcharts.
+        The results are cached if `cache_timeout` is set.
         :return: JsonResponse
         """
+        if self.cache_timeout is None or self.profile_report:
+            return self.compute_report_results(for_print)
+        return self.get_result_cache().get_or_compute(self.get_report_slug(), self.get_cache_parameters(for_print),
+                                                      lambda: self.compute_report_results(for_print))
 
+    def get_result_cache(self):
+        return self.result_cache_class(timeout=self.cache_timeout, models=self.get_cache_models())
+
+    @classmethod
+    def get_cache_models(cls):
+        """
+        Get the models the report results are computed from, a change in any of them invalidates the cached results.
+        Defaults to the report model, the group by and the crosstab models.
+        """
+        report_model = cls.get_report_model()
+        models = [report_model]
+        for field_name in (cls.group_by, cls.crosstab_model):
+            if not field_name:
+                continue
+            related_model = get_field_from_query_text(field_name, report_model).related_model
+            if related_model and related_model not in models:
+                models.append(related_model)
+        return models
+
+    def get_cache_parameters(self, for_print=False):
+        """
+        Get the parameters the report results depend on, used to key the results in the cache
+        :return: a dict
+        """
+        return {
+            'form': self.get_cache_form_data(),
+            'queryset': self.get_queryset_signature(),
+            'has_filters': bool(self.request.GET or self.request.POST),
+            'for_print': for_print,
+            'date_field': self.date_field,
+            'group_by': self.group_by,
+            'columns': self.columns,
+            'time_series_pattern': self.time_series_pattern,
+            'time_series_columns': self.time_series_columns,
+            'crosstab_model': self.crosstab_model,
+            'crosstab_columns': self.crosstab_columns,
+            'crosstab_compute_reminder': self.crosstab_compute_reminder,
+            'limit_records': self.limit_records,
+            'swap_sign': self.swap_sign,
+            'having': self.having,
+            'show_empty_records': self.show_empty_records,
+            'page': self.page,
+        }
+
+    def compute_report_results(self, for_print=False):
+        """
+        Computes the report Data, and, its meta data
+        """
         queryset = self.get_queryset()
-        report_generator = self.get_report_generator(queryset, for_print)
+        page = self.page if not for_print else None
+        report_generator = self.get_report_generator(queryset, for_print, **(page or {}))
         data = report_generator.get_report_data()
+        records_filtered = self.get_records_filtered(report_generator, data) if page else None
         data = self.filter_results(data, for_print)
 
-        return report_generator.get_full_response(data=data, report_slug=self.get_report_slug(),
-                                                           chart_settings=self.chart_settings,
-                                                           default_chart_title=self.report_title)
+        response = report_generator.get_full_response(data=data, report_slug=self.get_report_slug(),
+                                                      chart_settings=self.chart_settings,
+                                                      default_chart_title=self.report_title)
+        if page:
+            response['records_filtered'] = records_filtered
+        if report_generator.profile is not None and settings.DEBUG:
+            response['profile'] = report_generator.profile.as_dict()
+        return response
 
     @classmethod
     def get_metadata(cls, generator):
@@ -199,6 +495,28 @@ class SlickReportViewBase(FormView):
     def get_queryset(self):
         return self.queryset or self.report_model.objects
 
+    def get_cache_form_data(self):
+        """
+        Get the form cleaned data to key the results in the cache, the querysets (ie: the chosen foreign keys records)
+        replaced by the submitted primary keys so they are not evaluated on each request
+        """
+        data = {}
+        for name, value in self.form.cleaned_data.items():
+            if isinstance(value, QuerySet):
+                value = set(self.form[name].value() or [])
+            data[name] = value
+        return data
+
+    def get_queryset_signature(self):
+        """
+        Get the SQL of the report queryset, so the results of a queryset scoped to the request (ie: to the user) are
+        cached apart
+        """
+        try:
+            return str(self.get_queryset().all().query)
+        except EmptyResultSet:
+            return ''
+
     def filter_results(self, data, for_print=False):
         """
         Hook to Filter results based on computed data (like eliminate __balance__ = 0, etc)
@@ -224,24 +542,170 @@ class SlickReportViewBase(FormView):
         context = super().get_context_data(**kwargs)
         if not (self.request.POST or self.request.GET):
             # initialize empty form with initials if the no data is in the get or the post
-            context['form'] = self.get_form_class()()
+            context['form'] = self.get_form_class()(initial=dict(self.get_form_initial(), **self.get_initial()),
+                                                    prefix=self.get_prefix())
         return context
 
 
 class SlickReportView(SlickReportViewBase):
 
-    def __init_subclass__(cls) -> None:
-        date_field = getattr(cls, 'date_field', '')
-        if not date_field:
-            raise TypeError(f'`date_field` is not set on {cls}')
+    def __init_subclass__(cls, abstract=False, **kwargs) -> None:
+        """
+        :param abstract: skip the sanity checks, for classes meant to be subclassed by the actual reports
+        """
+        if not abstract:
+            date_field = getattr(cls, 'date_field', '')
+            if not date_field:
+                raise TypeError(f'`date_field` is not set on {cls}')
+
+            # sanity check, raises error if the columns or date fields is not mapped
+            cls.report_generator_class.check_columns([cls.date_field], False, cls.get_report_model())
+            cls.report_generator_class.check_columns(cls.columns, cls.group_by, cls.get_report_model())
 
-        # sanity check, raises error if the columns or date fields is not mapped
-        cls.report_generator_class.check_columns([cls.date_field], False, cls.get_report_model())
-        cls.report_generator_class.check_columns(cls.columns, cls.group_by, cls.get_report_model())
+            if cls.cache_timeout is not None:
+                for model in cls.get_cache_models():
+                    track_model(model)
 
-        super().__init_subclass__()
+        super().__init_subclass__(**kwargs)
 
     @staticmethod
     def check_chart_settings(chart_settings=None):
         #todo check on chart settings
         return
+
+
+class AsyncSlickReportView(SlickReportView, abstract=True):
+    """
+    Async version of SlickReportView, the report computation fields are prepared concurrently and the report is
+    fetched with the async ORM, so the event loop serves other requests meanwhile. To be served under ASGI.
+    Only GET requests are handled.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    async def get(self, request, *args, **kwargs):
+        form_class = self.get_form_class()
+        self.form = self.get_form(form_class)
+        # validating the form may query the database (ie: the model choice fields)
+        if await sync_to_async(self.form.is_valid)():
+            export_format = request.GET.get(self.export_parameter)
+            if export_format:
+                return await sync_to_async(self.export_to_response)(export_format)
+
+            self.page = self.get_page()
+            report_data = await self.aget_report_results()
+            if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+                if self.datatables_server_side and 'draw' in request.GET:
+                    return self.ajax_render_to_response(self.get_datatables_data(report_data))
+                return self.ajax_render_to_response(report_data)
+
+            return self.render_to_response(self.get_context_data(report_data=report_data))
+
+        return self.render_to_response(self.get_context_data())
+
+    def get_export_rows(self, report_generator):
+        # the ASGI handler iterates the streaming responses in the event loop, where the database can't be queried
+        return list(super().get_export_rows(report_generator))
+
+    async def aget_report_results(self, for_print=False):
+        """
+        Async version of `get_report_results`
+        """
+        if self.cache_timeout is None or self.profile_report:
+            return await self.acompute_report_results(for_print)
+
+        def get_or_compute():
+            # the cache parameters read the form cleaned data, which may hold querysets
+            return self.get_result_cache().get_or_compute(
+                self.get_report_slug(), self.get_cache_parameters(for_print),
+                lambda: async_to_sync(self.acompute_report_results)(for_print))
+
+        return await sync_to_async(get_or_compute)()
+
+    async def acompute_report_results(self, for_print=False):
+        """
+        Async version of `compute_report_results`
+        """
+        queryset = self.get_queryset()
+        page = self.page if not for_print else None
+        # the form filters & crosstab ids are read from querysets
+        report_generator = await sync_to_async(self.get_report_generator)(queryset, for_print, lazy_preparation=True,
+                                                                          **(page or {}))
+        data = await report_generator.aget_report_data()
+        records_filtered = self.get_records_filtered(report_generator, data) if page else None
+        data = await sync_to_async(self.filter_results)(data, for_print)
+
+        response = await sync_to_async(report_generator.get_full_response)(
+            data=data, report_slug=self.get_report_slug(), chart_settings=self.chart_settings,
+            default_chart_title=self.report_title)
+        if page:
+            response['records_filtered'] = records_filtered
+        if report_generator.profile is not None and settings.DEBUG:
+            response['profile'] = report_generator.profile.as_dict()
+        return response
+
+
+class ForeignKeyLookupView(View):
+    """
+    A paginated json lookup of the records related by a report form foreign key, in the select2 format, used by
+    `LazySelectMultiple`.
+    Only the foreign keys registered in `lookup_registry` can be looked up, by the users passing `has_permission`.
+    """
+    page_size = 20
+    search_parameter = 'term'
+    page_parameter = 'page'
+
+    def has_permission(self, request, foreign_key):
+        """
+        Hook to check the request can look up the records related by the foreign key, defaults to an authenticated
+        user with the view permission on the related model
+        """
+        opts = foreign_key.remote_field.model._meta
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_authenticated and \
+            user.has_perm(f'{opts.app_label}.{get_permission_codename("view", opts)}')
+
+    def get(self, request, lookup_key):
+        try:
+            foreign_key = lookup_registry.get_foreign_key(lookup_key)
+        except KeyError:
+            raise Http404(f'{lookup_key} is not a registered lookup')
+        if not self.has_permission(request, foreign_key):
+            raise PermissionDenied
+        try:
+            page = max(int(request.GET.get(self.page_parameter) or 1), 1)
+        except ValueError:
+            return HttpResponseBadRequest(f'Invalid {self.page_parameter}')
+
+        queryset = self.get_queryset(foreign_key)
+        term = request.GET.get(self.search_parameter, '').strip()
+        if term:
+            queryset = self.filter_queryset(queryset, term, self.get_search_fields(lookup_key))
+        start = (page - 1) * self.page_size
+        # fetching one more record tells if there is a next page, without counting
+        records = list(queryset[start:start + self.page_size + 1])
+        to_field_name = foreign_key.remote_field.field_name
+        return JsonResponse({
+            'results': [{'id': x.serializable_value(to_field_name), 'text': str(x)} for x in records[:self.page_size]],
+            'pagination': {'more': len(records) > self.page_size},
+        })
+
+    def get_queryset(self, foreign_key):
+        """
+        The records which can be chosen, as the form field would offer them
+        """
+        model = foreign_key.remote_field.model
+        queryset = model._default_manager.complex_filter(foreign_key.get_limit_choices_to())
+        return queryset.order_by(*(model._meta.ordering or ['pk']))
+
+    def get_search_fields(self, lookup_key):
+        """
+        Hook to get the fields searched by the term, default to the `search_fields` the foreign key is registered with
+        :return: a list of fields names
+        """
+        return lookup_registry.get_search_fields(lookup_key)
+
+    def filter_queryset(self, queryset, term, search_fields):
+        filters = Q()
+        for name in search_fields:
+            filters |= Q(**{f'{name}__icontains': term})
+        return queryset.filter(filters) if filters else queryset.none()
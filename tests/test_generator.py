@@ -1,18 +1,26 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
-import pytz
-from django.db.models import Sum
-from django.test import TestCase
+import time
+from io import StringIO
+from unittest.mock import patch
 
-from slick_reporting.fields import SlickReportField
-from slick_reporting.generator import ReportGenerator
+import pytz
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db.models import Count, QuerySet, Sum
+from django.test import TestCase, TransactionTestCase
+
+from slick_reporting.fields import SlickReportField, BalanceReportField
+from slick_reporting.generator import ReportGenerator, TIME_SERIES_TRUNCATION_KINDS
 from slick_reporting.helpers import get_foreign_keys
+from slick_reporting.rollups import Rollup, rollup_registry
 from .models import OrderLine
 
 from .report_generators import GeneratorWithAttrAsColumn, CrosstabOnClient, GenericGenerator, GroupByCharField, \
-    TimeSeriesCustomDates
+    TimeSeriesCustomDates, ProductTotalSales, TimeSeriesWithOutGroupBy, GroupByCharFieldPlusTimeSeries
 
-from .tests import BaseTestData, year
+from .tests import BaseTestData, BaseTransactionTestData, ReportGeneratorTestMixin, year
 from .models import SimpleSales, Client
 
 
@@ -256,6 +264,583 @@ class TestReportFields(TestCase):
         self.assertEqual(len(deps), 1)
 
 
+class TestReportFieldsData(BaseTestData, TestCase):
+
+    def test_extract_data_is_indexed_once(self):
+        from slick_reporting.fields import TotalReportField
+        field = TotalReportField(report_model=SimpleSales, group_by='client', date_field='doc_date')
+        field.init_preparation(None, {})
+        debit_index, credit_index = field._get_indexed_data(field._cache)
+        self.assertEqual(debit_index[str(self.client1.pk)], 300)
+        self.assertIs(field._get_indexed_data(field._cache)[0], debit_index)
+        self.assertEqual(field.resolve(str(self.client2.pk)), 600)
+        self.assertEqual(field.resolve(str(self.clientIdle.pk)), 0)
+
+
+class TestQueryFusion(BaseTestData, ReportGeneratorTestMixin, TestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name', '__total_quantity__', SlickReportField.create(Sum, 'value', name='sum__value'),
+                             SlickReportField.create(Count, 'id', name='count__id')])
+
+    def test_fields_computed_in_one_query(self):
+        class NotFusedGenerator(ReportGenerator):
+            fuse_queries = False
+
+        # one query for the fields, one for the main queryset
+        with self.assertNumQueries(2):
+            data = self.get_generator().get_report_data()
+        self.assertEqual(data[0]['__total_quantity__'], 30)
+        self.assertEqual(data[0]['sum__value'], 300)
+        self.assertEqual(data[0]['count__id'], 3)
+
+        with self.assertNumQueries(4):
+            not_fused_data = self.get_generator(NotFusedGenerator).get_report_data()
+        self.assertEqual(not_fused_data, data)
+
+    def test_fields_with_dependencies_fused(self):
+        report = ProductTotalSales()
+        data = report.get_report_data()
+        self.assertEqual(data[0]['__balance__'], 1800)
+        self.assertEqual(data[0]['__balance_quantity__'], 180)
+
+    def test_custom_preparation_not_fused(self):
+        prepared = []
+
+        class CustomPreparationField(SlickReportField):
+            name = 'custom_preparation'
+            calculation_method = Sum
+            calculation_field = 'value'
+
+            def init_preparation(self, q_filters=None, kwargs_filters=None, **kwargs):
+                prepared.append(self.name)
+                super().init_preparation(q_filters, kwargs_filters, **kwargs)
+
+        self.assertFalse(CustomPreparationField().can_fuse())
+        data = self.get_generator(columns=['name', '__total_quantity__', CustomPreparationField]).get_report_data()
+        self.assertEqual(prepared, ['custom_preparation'])
+        self.assertEqual(data[0]['custom_preparation'], 300)
+
+
+class TestTimeSeriesSingleQuery(BaseTestData, ReportGeneratorTestMixin, TestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name'], time_series_pattern='monthly',
+                    time_series_columns=['__total__', '__debit__', '__total_quantity__'])
+
+    def test_time_series_computed_in_one_query(self):
+        class PerPeriodGenerator(ReportGenerator):
+            time_series_single_query = False
+
+        # one query for the whole series, one for the main queryset
+        with self.assertNumQueries(2):
+            data = self.get_generator().get_report_data()
+        self.assertEqual(data[0][f'__total__TS{year}0201'], 100)
+        self.assertEqual(data[1][f'__total_quantity__TS{year}0301'], 20)
+        self.assertEqual(data[2][f'__debit__TS{year}1201'], 0)
+        self.assertEqual(data, self.get_generator(PerPeriodGenerator).get_report_data())
+
+    def test_time_series_patterns(self):
+        class PerPeriodGenerator(ReportGenerator):
+            time_series_single_query = False
+
+        first_monday = datetime(year, 1, 1) + timedelta(days=-datetime(year, 1, 1).weekday() % 7)
+        for pattern, start_date in [('daily', datetime(year, 1, 1)), ('weekly', first_monday),
+                                    ('quarterly', datetime(year, 1, 1)), ('annually', datetime(year, 1, 1))]:
+            kwargs = dict(time_series_pattern=pattern, start_date=start_date, end_date=datetime(year, 4, 1))
+            report = self.get_generator(**kwargs)
+            self.assertEqual(report._get_time_series_truncation(report._get_time_series_dates()),
+                             TIME_SERIES_TRUNCATION_KINDS[pattern])
+            per_period_report = self.get_generator(PerPeriodGenerator, **kwargs)
+            self.assertEqual(report.get_report_data(), per_period_report.get_report_data())
+
+    def test_running_balances(self):
+        class PerPeriodGenerator(ReportGenerator):
+            time_series_single_query = False
+
+        kwargs = dict(time_series_columns=['__balance__', '__balance_quantity__', '__total__'],
+                      start_date=datetime(year, 2, 1), end_date=datetime(year, 6, 1))
+        # one query for the series, one for each of the first balances and one for the main queryset
+        with self.assertNumQueries(4):
+            data = self.get_generator(**kwargs).get_report_data()
+        self.assertEqual(data[0][f'__balance__TS{year}0301'], 200)
+        self.assertEqual(data[0][f'__balance__TS{year}0601'], 300)
+        self.assertEqual(data[2][f'__balance_quantity__TS{year}0401'], 90)
+        self.assertEqual(data, self.get_generator(PerPeriodGenerator, **kwargs).get_report_data())
+
+    def test_not_aligned_series_fallback(self):
+        report = self.get_generator(start_date=datetime(year, 1, 15), end_date=datetime(year, 6, 1))
+        self.assertIsNone(report._get_time_series_truncation(report._get_time_series_dates()))
+        data = report.get_report_data()
+        self.assertEqual(data[0][f'__total__TS{year}0215'], 100)
+
+    def test_without_group_by(self):
+        report = TimeSeriesWithOutGroupBy()
+        data = report.get_report_data()
+        self.assertEqual(data[0][f'__total__TS{year}0201'], 600)
+        self.assertEqual(data[0][f'__total__TS{year}0601'], 0)
+
+
+class TestCrosstabSingleQuery(BaseTestData, ReportGeneratorTestMixin, TestCase):
+
+    def get_generator_kwargs(self):
+        return dict(group_by='product', columns=['name'], crosstab_model='client',
+                    crosstab_columns=['__total__', '__balance_quantity__'],
+                    crosstab_ids=[self.client1.pk, self.client2.pk])
+
+    def test_crosstab_computed_in_one_query(self):
+        class PerIdGenerator(ReportGenerator):
+            crosstab_single_query = False
+
+        # one query for all the crosstab ids, one for the first balance and one for the main queryset
+        with self.assertNumQueries(3):
+            data = self.get_generator().get_report_data()
+        self.assertEqual(data[0][f'__total__CT{self.client1.pk}'], 300)
+        self.assertEqual(data[0][f'__total__CT{self.client2.pk}'], 600)
+        self.assertEqual(data[0]['__total__CT----'], 900)
+        self.assertEqual(data[0]['__balance_quantity__CT----'], 90)
+        self.assertEqual(data, self.get_generator(PerIdGenerator).get_report_data())
+
+        data = self.get_generator(crosstab_compute_reminder=False).get_report_data()
+        self.assertEqual(data[0][f'__total__CT{self.client2.pk}'], 600)
+        self.assertNotIn('__total__CT----', data[0])
+        per_id_data = self.get_generator(PerIdGenerator, crosstab_compute_reminder=False).get_report_data()
+        self.assertEqual(data, per_id_data)
+
+    def test_reminder_with_nullable_crosstab(self):
+        class PerIdGenerator(ReportGenerator):
+            crosstab_single_query = False
+
+        content_type = ContentType.objects.get_for_model(Client)
+        SimpleSales.objects.filter(client=self.client3).update(content_type=content_type)
+        kwargs = dict(report_model=SimpleSales, group_by='client', date_field='doc_date', columns=['name'],
+                      crosstab_model='content_type', crosstab_columns=['__total__'], crosstab_ids=[content_type.pk])
+        data = ReportGenerator(**kwargs).get_report_data()
+        # the sales without a content type are in the reminder
+        self.assertEqual([(x['name'], x['__total__CT----']) for x in data],
+                         [('Client 1', 300), ('Client 2', 600), ('Client 3', 0)])
+        self.assertEqual(data, PerIdGenerator(**kwargs).get_report_data())
+
+
+class TestComputationCache(BaseTestData, TestCase):
+
+    def test_shared_dependency_prepared_once(self):
+        class FirstBalancePlusOne(SlickReportField):
+            name = 'fb_plus_one'
+            verbose_name = 'fb plus one'
+            requires = ['__fb__']
+
+            def final_calculation(self, debit, credit, dep_dict):
+                return dep_dict['__fb__'] + 1
+
+        # one fused query for both fields, one for `__fb__` and one for the main queryset
+        with self.assertNumQueries(3):
+            report = ReportGenerator(report_model=SimpleSales, group_by='client', date_field='doc_date',
+                                     columns=['name', '__balance__', FirstBalancePlusOne])
+            data = report.get_report_data()
+        self.assertEqual(data[0]['__balance__'], 300)
+        self.assertEqual(data[0]['fb_plus_one'], 1)
+        balance_dependencies = report.report_fields_classes['__balance__']._cache[2]
+        fb_plus_one_dependencies = report.report_fields_classes['fb_plus_one']._cache[2]
+        self.assertIs(balance_dependencies['__fb__']['instance'], fb_plus_one_dependencies['__fb__']['instance'])
+
+
+class TestColumnPlans(TestCase):
+
+    def setUp(self):
+        GroupByCharFieldPlusTimeSeries.clear_column_plans()
+
+    def test_plan_shared_between_runs(self):
+        report = GroupByCharFieldPlusTimeSeries(start_date=datetime(year, 1, 1), end_date=datetime(year + 1, 1, 1))
+        with patch.object(GroupByCharFieldPlusTimeSeries, 'check_columns') as check_columns:
+            other = GroupByCharFieldPlusTimeSeries(start_date=datetime(year, 1, 1), end_date=datetime(year + 1, 1, 1))
+            self.assertFalse(check_columns.called)
+        self.assertIs(other._column_plan, report._column_plan)
+        self.assertEqual(other.get_list_display_columns(), report.get_list_display_columns())
+
+        # the time series columns depend on the dates
+        other = GroupByCharFieldPlusTimeSeries(start_date=datetime(year, 1, 1), end_date=datetime(year, 7, 1))
+        self.assertIsNot(other._column_plan, report._column_plan)
+        self.assertEqual(len(other.get_metadata()['time_series_column_names']), 6)
+
+    def test_columns_copied_per_run(self):
+        report = GroupByCharFieldPlusTimeSeries()
+        columns = report.get_list_display_columns()
+        self.assertIs(columns[0], report.parsed_columns[0])
+        columns[0]['verbose_name'] = 'Changed'
+        report._time_series_parsed_columns[0]['extra'] = True
+
+        other = GroupByCharFieldPlusTimeSeries()
+        self.assertIs(other._column_plan, report._column_plan)
+        self.assertNotEqual(other.get_list_display_columns()[0]['verbose_name'], 'Changed')
+        self.assertNotIn('extra', other._time_series_parsed_columns[0])
+        with self.assertRaises(TypeError):
+            report._column_plan.parsed_columns[0]['verbose_name'] = 'Changed'
+
+    def test_cache_disabled(self):
+        with patch.object(GroupByCharFieldPlusTimeSeries, 'column_plans_cache_size', 0):
+            report = GroupByCharFieldPlusTimeSeries()
+            self.assertIsNot(GroupByCharFieldPlusTimeSeries()._column_plan, report._column_plan)
+
+
+class TestIterReportData(BaseTestData, TestCase):
+
+    def test_iter_report_data(self):
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'])
+        expected = report.get_report_data()
+
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'])
+        report.iterator_chunk_size = 2
+        rows = report.iter_report_data()
+        self.assertEqual(next(rows), expected[0])
+        self.assertEqual([expected[0]] + list(rows), expected)
+
+        report = ProductTotalSales(profile_report=True)
+        self.assertEqual(list(report.iter_report_data()), ProductTotalSales().get_report_data())
+        self.assertIn('format_row', report.profile.phases)
+
+
+class GrandTotalField(SlickReportField):
+    name = 'grand_total'
+    calculation_field = 'value'
+    calculation_method = Sum
+    prevent_group_by = True
+
+
+class TestPagination(BaseTestData, ReportGeneratorTestMixin, TestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name', '__total__', '__balance__'], start_date=datetime(year, 1, 1),
+                    end_date=datetime(year + 1, 1, 1))
+
+    def test_order_by_computation_field(self):
+        report = self.get_generator(order_by=['-__total__'], page_length=2)
+        data = report.get_report_data()
+        self.assertEqual([x['name'] for x in data], ['Client 3', 'Client 2'])
+        self.assertEqual(report.records_filtered, 3)
+        expected = {x['name']: x for x in self.get_generator().get_report_data()}
+        self.assertEqual(data, [expected['Client 3'], expected['Client 2']])
+
+        data = self.get_generator(order_by=['-__total__'], page_offset=2, page_length=2).get_report_data()
+        self.assertEqual(data, [expected['Client 1']])
+
+    def test_order_by_aggregate_in_sql(self):
+        report = self.get_generator(columns=['name', '__total__'], order_by=['__total__'], limit_records=2,
+                                    profile_report=True)
+        data = report.get_report_data()
+        self.assertEqual([x['name'] for x in data], ['Client 1', 'Client 2'])
+        self.assertEqual(report._group_keys_filters, {'client__in': [self.client1.pk, self.client2.pk]})
+        ordering_queries = [x for x in report.profile.queries if 'slick_order_value' in x['sql']]
+        self.assertEqual([x['rows'] for x in ordering_queries], [2])
+
+        # the report wide fields are not restricted to the top keys
+        data = self.get_generator(columns=['name', '__total__', GrandTotalField], order_by=['-__total__'],
+                                  limit_records=2).get_report_data()
+        self.assertEqual([(x['name'], x['grand_total']) for x in data], [('Client 3', 1800), ('Client 2', 1800)])
+
+        # the balance needs the first balance, it is ordered after being computed for all the clients
+        self.assertIsNone(report._create_report_field(BalanceReportField).get_aggregate_expression())
+        data = self.get_generator(order_by=['-__balance__'], page_length=1).get_report_data()
+        self.assertEqual([x['name'] for x in data], ['Client 3'])
+
+    def test_having(self):
+        report = self.get_generator(having={'__total__': ('gt', 500)}, profile_report=True)
+        self.assertEqual([x['name'] for x in report.get_report_data()], ['Client 2', 'Client 3'])
+        self.assertTrue(any('slick_having_0' in x['sql'] for x in report.profile.queries))
+
+        report = self.get_generator(having={'__total__': ('gt', 500)}, swap_sign=True)
+        self.assertEqual(report.get_report_data(), [])
+
+        # computed for all the groups, then filtered
+        report = self.get_generator(having={'__balance__': ('lte', 600), '__total__': ('ne', 300)},
+                                    order_by=['-__balance__'])
+        self.assertEqual([x['name'] for x in report.get_report_data()], ['Client 2'])
+
+        # filtering the groups does not change the report wide figures
+        report = self.get_generator(columns=['name', '__total__', GrandTotalField], having={'__total__': ('gt', 500)})
+        self.assertEqual([(x['name'], x['grand_total']) for x in report.get_report_data()],
+                         [('Client 2', 1800), ('Client 3', 1800)])
+
+        with self.assertRaises(ImproperlyConfigured):
+            self.get_generator(having={'__total__': ('contains', 5)})
+
+    def test_report_wide_field_on_every_page(self):
+        columns = ['name', '__total__', GrandTotalField]
+        for offset in range(3):
+            data = self.get_generator(columns=columns, order_by=['-__total__'], page_offset=offset,
+                                      page_length=1).get_report_data()
+            self.assertEqual(len(data), 1)
+            self.assertEqual(data[0]['grand_total'], 1800)
+
+    def test_order_by_database_column(self):
+        report = self.get_generator(order_by=['-name'], page_offset=1, page_length=1, profile_report=True)
+        data = report.get_report_data()
+        self.assertEqual([x['name'] for x in data], ['Client 2'])
+        self.assertEqual(report._group_keys_filters, {'client__in': [self.client2.pk]})
+        # the computation fields are restricted to the page keys
+        queries = [x for x in report.profile.queries if x['field']]
+        self.assertTrue(queries)
+        self.assertTrue(all(x['rows'] <= 1 for x in queries))
+
+    def test_detail_report_page(self):
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date', columns=['slug', 'doc_date', 'value'],
+                                 start_date=datetime(year, 1, 1), end_date=datetime(year + 1, 1, 1),
+                                 order_by=['-doc_date', 'unknown'], page_length=2)
+        data = report.get_report_data()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[0]['doc_date'], SimpleSales.objects.order_by('-doc_date', 'pk')[0].doc_date)
+        self.assertEqual(report.records_filtered, SimpleSales.objects.filter(doc_date__year=year).count())
+
+
+class TestShowEmptyRecords(BaseTestData, ReportGeneratorTestMixin, TestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name', SlickReportField.create(Sum, 'value', name='value__sum'),
+                             SlickReportField.create(Sum, 'quantity', name='quantity__sum')],
+                    start_date=datetime(year, 1, 1), end_date=datetime(year + 1, 1, 1))
+
+    def test_empty_records_in_one_query(self):
+        with self.assertNumQueries(1):
+            data = self.get_generator(show_empty_records=True).get_report_data()
+        data = {x['name']: x for x in data}
+        self.assertEqual(data['Client Idle']['value__sum'], 0)
+        self.assertEqual(data['Client Idle']['quantity__sum'], 0)
+        self.assertEqual(data['Client 3']['value__sum'], 900)
+        for row in self.get_generator().get_report_data():
+            self.assertEqual(data[row['name']], row)
+
+    def test_empty_records_streamed(self):
+        report = self.get_generator(show_empty_records=True, columns=['name', '__balance__', '__total_quantity__'])
+        report.iterator_chunk_size = 2
+        rows = report.iter_report_data()
+        first = next(rows)
+        # the records are read in chunks along with their computation fields
+        self.assertIsInstance(report.main_queryset, QuerySet)
+        data = {x['name']: x for x in [first] + list(rows)}
+        self.assertEqual(data['Client Idle']['__total_quantity__'], 0)
+        self.assertEqual(data['Client 3']['__balance__'], 900)
+        for row in self.get_generator(columns=['name', '__balance__', '__total_quantity__']).get_report_data():
+            self.assertEqual(data[row['name']], row)
+
+    def test_group_by_filters(self):
+        report = self.get_generator(show_empty_records=True,
+                                    kwargs_filters={'client_id__in': [self.client2.pk, self.clientIdle.pk]})
+        self.assertEqual({x['name']: x['value__sum'] for x in report.get_report_data()},
+                         {'Client 2': 600, 'Client Idle': 0})
+
+        # fields with their own query flow, or requirements, are resolved to 0 for the empty records
+        report = self.get_generator(show_empty_records=True, columns=['name', '__balance__'],
+                                    kwargs_filters={'client': self.clientIdle.pk})
+        self.assertEqual(report.get_report_data(), [{'name': 'Client Idle', '__balance__': 0}])
+
+
+class TestReportProfile(BaseTestData, TestCase):
+
+    def test_profile_queries_and_phases(self):
+        report = ReportGenerator(report_model=SimpleSales, group_by='product', date_field='doc_date',
+                                 columns=['name', '__total__'], crosstab_model='client', crosstab_columns=['__total__'],
+                                 crosstab_ids=[self.client1.pk], profile_report=True)
+        data = report.get_report_data()
+        profile = report.profile.as_dict()
+
+        self.assertEqual(list(profile['phases']),
+                         ['_parse', '_prepare_report_dependencies', 'main_queryset', 'row_assembly', 'format_row'])
+        self.assertEqual(profile['query_count'], len(report.profile.queries))
+        queries = {(x['field'], x['window']): x for x in report.profile.queries}
+        self.assertEqual(queries[('__total__', 'normal')]['rows'], len(data))
+        # the crosstab fields are computed in one query, attributed to all of them
+        crosstab_query = [x for x in report.profile.queries if x['window'] == 'crosstab'][0]
+        self.assertIn('__total__', crosstab_query['field'])
+        self.assertEqual(crosstab_query['rows'], len(data))
+        self.assertEqual(queries[(None, None)]['rows'], len(data))
+        self.assertIn('SELECT', queries[('__total__', 'normal')]['sql'])
+
+        self.assertIsNone(ReportGenerator(report_model=SimpleSales, group_by='product', date_field='doc_date',
+                                          columns=['name', '__total__']).profile)
+
+
+class TestPreparationWorkers(BaseTransactionTestData, ReportGeneratorTestMixin, TransactionTestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name', '__balance__', '__balance_quantity__', '__fb__',
+                             SlickReportField.create(Count, 'id', name='count__id')],
+                    start_date=datetime(year, 2, 1))
+
+    def test_fields_prepared_in_threads(self):
+        class NotFusedGenerator(ReportGenerator):
+            fuse_queries = False
+
+        expected = self.get_generator(NotFusedGenerator).get_report_data()
+
+        # the computation fields are prepared and evaluated in the threads, only the main queryset is left
+        with self.assertNumQueries(1):
+            data = self.get_generator(NotFusedGenerator, preparation_workers=3).get_report_data()
+        self.assertEqual(data, expected)
+        self.assertEqual(data, self.get_generator(preparation_workers=3).get_report_data())
+
+        report = self.get_generator(NotFusedGenerator, preparation_workers=3, profile_report=True)
+        report.get_report_data()
+        self.assertIn('count__id', [x['field'] for x in report.profile.queries])
+
+    def test_thread_exception_raised(self):
+        class FailingField(SlickReportField):
+            name = 'failing_field'
+
+            def prepare(self, q_filters=None, kwargs_filters=None, **kwargs):
+                raise ValueError('failed')
+
+        with self.assertRaisesMessage(ValueError, 'failed'):
+            self.get_generator(preparation_workers=2, columns=['name', '__total__', FailingField])
+
+    def test_shared_dependency_evaluated_once(self):
+        class NotFusedGenerator(ReportGenerator):
+            fuse_queries = False
+
+        shared_field = SlickReportField.create(Count, 'id', name='shared__count')
+
+        class ValueField(SlickReportField):
+            name = 'value_with_count'
+            requires = [shared_field]
+
+        class QuantityField(SlickReportField):
+            name = 'quantity_with_count'
+            calculation_field = 'quantity'
+            requires = [shared_field]
+
+        fetch_all = QuerySet._fetch_all
+
+        def slow_fetch_all(queryset):
+            # widen the window where both threads evaluate the shared dependency
+            time.sleep(0.05)
+            fetch_all(queryset)
+
+        with patch.object(QuerySet, '_fetch_all', slow_fetch_all):
+            report = self.get_generator(NotFusedGenerator, preparation_workers=2, profile_report=True,
+                                        columns=['name', ValueField, QuantityField])
+        self.assertEqual(len([x for x in report.profile.queries if 'COUNT(' in x['sql']]), 1)
+
+
+class TestRollups(BaseTransactionTestData, ReportGeneratorTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # a second sale on the same days, rolled up together with the first
+        for client in self.clients:
+            for month in range(1, 4):
+                SimpleSales.objects.create(doc_date=datetime(year, month, 2, 15), client=client,
+                                           product=self.product, quantity=1, price=10)
+
+        class DailySales(Rollup):
+            report_model = SimpleSales
+            date_field = 'doc_date'
+            dimensions = ['client', 'product']
+            measures = ['quantity', 'value']
+
+        rollup_registry.register(DailySales)
+        self.addCleanup(rollup_registry.unregister, 'dailysales')
+        self.rollup = rollup_registry.get_rollup_by_name('dailysales')
+
+    def tearDown(self):
+        if self.rollup.table_exists():
+            self.rollup.drop_table()
+
+    def get_generator_kwargs(self):
+        return dict(columns=['name', '__total__', '__balance__', '__fb__',
+                             SlickReportField.create(Count, 'id', name='count__id')],
+                    start_date=datetime(year, 2, 1))
+
+    def get_raw_report_data(self, **kwargs):
+        with patch.object(SlickReportField, 'use_rollups', False):
+            return self.get_generator(**kwargs).get_report_data()
+
+    def get_rollup_queries(self, **kwargs):
+        report = self.get_generator(profile_report=True, **kwargs)
+        data = report.get_report_data()
+        return data, [x for x in report.profile.queries if self.rollup.db_table in x['sql']]
+
+    def test_refresh(self):
+        stdout = StringIO()
+        call_command('refresh_rollups', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'dailysales: 18 records rolled up')
+        rows = self.rollup.get_model().objects.all()
+        self.assertEqual(len(rows), 9)
+        self.assertEqual({(x.quantity, x.record_count) for x in rows}, {(2, 2), (3, 2), (4, 2)})
+
+        SimpleSales.objects.create(doc_date=datetime(year, 3, 2, 18), client=self.clients[0],
+                                   product=self.product, quantity=4, price=10)
+        self.assertEqual(self.rollup.refresh(), 1)
+        row = self.rollup.get_model().objects.get(doc_date=datetime(year, 3, 2), client=self.clients[0].pk)
+        self.assertEqual((row.quantity, row.value, row.record_count), (6, 60, 3))
+        self.assertEqual(self.rollup.get_state().high_water_mark, SimpleSales.objects.order_by('-pk')[0].pk)
+
+        # deleting a rolled up record invalidates the rollup, rebuilt by the next refresh
+        SimpleSales.objects.filter(quantity=4).delete()
+        self.assertIsNone(self.rollup.get_state().high_water_mark)
+        self.assertEqual(self.rollup.refresh(), 18)
+        row = self.rollup.get_model().objects.get(doc_date=datetime(year, 3, 2), client=self.clients[0].pk)
+        self.assertEqual(row.record_count, 2)
+
+    def test_report_from_rollup(self):
+        expected = self.get_raw_report_data()
+        self.assertEqual(self.get_rollup_queries()[1], [], 'A rollup never refreshed is not used')
+
+        self.rollup.refresh()
+        data, queries = self.get_rollup_queries()
+        self.assertEqual(data, expected)
+        self.assertTrue(queries)
+
+        # the records added since the refresh are accounted for
+        SimpleSales.objects.create(doc_date=datetime(year, 2, 5), client=self.clients[1],
+                                   product=self.product, quantity=5, price=10)
+        self.assertEqual(self.get_generator().get_report_data(), self.get_raw_report_data())
+        self.assertNotEqual(self.get_raw_report_data(), expected)
+
+    def test_changed_record_invalidates_rollup(self):
+        self.rollup.refresh()
+        sale = SimpleSales.objects.filter(doc_date__month=2).first()
+        sale.quantity = 20
+        sale.save()
+        data, queries = self.get_rollup_queries()
+        self.assertEqual(queries, [], 'An invalidated rollup is not used')
+        self.assertEqual(data, self.get_raw_report_data())
+
+        self.rollup.refresh()
+        data, queries = self.get_rollup_queries()
+        self.assertTrue(queries)
+        self.assertEqual(data, self.get_raw_report_data())
+
+    def test_state_loaded_once(self):
+        self.rollup.refresh()
+        kwargs = dict(time_series_pattern='monthly', time_series_columns=['__total__', '__balance__'],
+                      start_date=datetime(year, 1, 1), end_date=datetime(year, 4, 1))
+        report = self.get_generator(profile_report=True, **kwargs)
+        report.get_report_data()
+        self.assertEqual(len([x for x in report.profile.queries if 'slick_reporting_rollupstate' in x['sql']]), 1)
+
+    def test_time_series_from_rollup(self):
+        self.rollup.refresh()
+        kwargs = dict(columns=['name', '__total__'], time_series_pattern='monthly',
+                      time_series_columns=['__total__', '__balance__'], start_date=datetime(year, 1, 1),
+                      end_date=datetime(year, 4, 1))
+        data, queries = self.get_rollup_queries(**kwargs)
+        self.assertEqual(data, self.get_raw_report_data(**kwargs))
+        self.assertTrue(queries)
+
+    def test_incompatible_fields(self):
+        self.rollup.refresh()
+        # not a day boundary
+        data, queries = self.get_rollup_queries(start_date=datetime(year, 2, 1, 12))
+        self.assertEqual(queries, [])
+        self.assertEqual(data, self.get_raw_report_data(start_date=datetime(year, 2, 1, 12)))
+
+        # not a rolled up measure
+        price_field = SlickReportField.create(Sum, 'price', name='sum__price')
+        data, queries = self.get_rollup_queries(columns=['name', price_field])
+        self.assertEqual(queries, [])
+
+
 class TestHelpers(TestCase):
     def test_get_model_for_keys(self):
         keys = get_foreign_keys(OrderLine)
@@ -38,6 +38,11 @@ INSTALLED_APPS = [
 
 ROOT_URLCONF = 'tests.urls'
 
+MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
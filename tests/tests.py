@@ -1,17 +1,33 @@
+import csv
 import datetime
-
+import json
+import threading
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
 from django.db.models import Count
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils.timezone import now
 
-from slick_reporting.fields import SlickReportField, BalanceReportField
+from slick_reporting.cache import ReportResultCache, VersionedQuerySet, track_model
+from slick_reporting.fields import SlickReportField, BalanceReportField, FirstBalanceField
+from slick_reporting.form_factory import report_form_factory
+from slick_reporting.forms import LazyModelMultipleChoiceField
 from slick_reporting.generator import ReportGenerator
-from slick_reporting.registry import field_registry
+from slick_reporting.models import BalanceSnapshot
+from slick_reporting.registry import field_registry, lookup_registry
+from slick_reporting.views import ForeignKeyLookupView
 from tests.report_generators import ClientTotalBalance, ProductClientSalesMatrix2, GroupByCharField, \
     GroupByCharFieldPlusTimeSeries, TimeSeriesWithOutGroupBy
-from . import report_generators
+from . import report_generators, views
 from .models import Client, Contact, Product, SimpleSales, UserJoined, SalesWithFlag, ComplexSales, TaxCode, \
     ProductCustomID, SalesProductWithCustomID
 from .views import SlickReportView
@@ -123,6 +139,38 @@ class BaseTestData:
             product=cls.product_w_custom_id2, quantity=10, price=10, created_at=datetime.datetime(year, 3, 3))
 
 
+class BaseTransactionTestData:
+    """
+    The data of the TransactionTestCase tests, which can't use setUpTestData:
+    three clients with a sale on the 2nd of each of the first three months.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name='Product 1')
+        self.clients = [Client.objects.create(name=f'Client {index}') for index in range(3)]
+        for index, client in enumerate(self.clients):
+            for month in range(1, 4):
+                SimpleSales.objects.create(doc_date=datetime.datetime(year, month, 2), client=client,
+                                           product=self.product, quantity=index + 1, price=10)
+
+
+class ReportGeneratorTestMixin:
+    """
+    Creates the ReportGenerator of a test on SimpleSales grouped by client,
+    the test defaults are set by get_generator_kwargs and overridden by the keyword arguments.
+    """
+
+    def get_generator_kwargs(self):
+        return {}
+
+    def get_generator(self, generator_class=ReportGenerator, **kwargs):
+        options = dict(report_model=SimpleSales, group_by='client', date_field='doc_date')
+        options.update(self.get_generator_kwargs())
+        options.update(kwargs)
+        return generator_class(**options)
+
+
 
 # @override_settings(ROOT_URLCONF='reporting_tests.urls', RA_CACHE_REPORTS=False, USE_TZ=False)
 class ReportTest(BaseTestData, TestCase):
@@ -181,6 +229,67 @@ class ReportTest(BaseTestData, TestCase):
         data = report.get_report_data()
         self.assertEqual(len(data), 9)
 
+    def test_client_statement_running_balance(self):
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'],
+                                 kwargs_filters={'client': self.client1.pk},
+                                 start_date=datetime.datetime(year, 2, 1))
+        with self.assertNumQueries(1):
+            data = report.get_report_data()
+        self.assertEqual([x['__running_balance__'] for x in data], [200, 300])
+
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'])
+        data = report.get_report_data()
+        self.assertEqual(len(data), 9)
+        self.assertEqual(data[-1]['__running_balance__'], 1800)
+
+    def test_running_balance_on_start_date(self):
+        # the records of a detail report are those after the start date, the ones on it are in the opening balance
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'],
+                                 kwargs_filters={'client': self.client1.pk},
+                                 start_date=datetime.datetime(year, 2, 2))
+        data = report.get_report_data()
+        self.assertEqual([x['__running_balance__'] for x in data], [300])
+
+    def test_running_balance_swap_sign(self):
+        report = ReportGenerator(report_model=SimpleSales, date_field='doc_date',
+                                 columns=['doc_date', 'value', '__running_balance__'],
+                                 kwargs_filters={'client': self.client1.pk},
+                                 start_date=datetime.datetime(year, 2, 2), swap_sign=True)
+        self.assertEqual([x['__running_balance__'] for x in report.get_report_data()], [-300])
+
+    def test_running_balance_in_grouped_report(self):
+        for kwargs in (dict(group_by='client', columns=['name', '__running_balance__']),
+                       dict(time_series_pattern='monthly', columns=['doc_date', '__running_balance__'])):
+            with self.assertRaises(ImproperlyConfigured):
+                ReportGenerator(report_model=SimpleSales, date_field='doc_date', **kwargs)
+        with self.assertRaises(ImproperlyConfigured):
+            ReportGenerator(report_model=SimpleSales, date_field='doc_date', group_by='client',
+                            columns=['name'], time_series_pattern='monthly',
+                            time_series_columns=['__running_balance__'])
+
+    def test_first_balance_from_snapshots(self):
+        call_command('build_balance_snapshots', 'tests.SimpleSales', '--date-field', 'doc_date', '--group-by', 'client',
+                     '--start-date', f'{year}-01-01', '--end-date', f'{year}-03-01', stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.filter(date=datetime.datetime(year, 3, 1)).count(), 3)
+
+        def get_first_balances():
+            report = ReportGenerator(report_model=SimpleSales, date_field='doc_date', group_by='client',
+                                     columns=['name', '__fb__'], start_date=datetime.datetime(year, 3, 1, 12))
+            return {x['name']: x['__fb__'] for x in report.get_report_data()}
+
+        expected = get_first_balances()
+        self.assertEqual(expected[self.client1.name], 200)
+        with patch.object(FirstBalanceField, 'use_snapshots', True):
+            self.assertEqual(get_first_balances(), expected)
+
+            # The balance is the nearest snapshot plus the movement from the snapshot date on
+            BalanceSnapshot.objects.filter(date=datetime.datetime(year, 3, 1)).delete()
+            BalanceSnapshot.objects.filter(group_value=str(self.client1.pk)).update(value=1000)
+            self.assertEqual(get_first_balances()[self.client1.name], 1000 + 100)
+
     def test_productclientsalesmatrix(self):
         report = report_generators.ProductClientSalesMatrix(crosstab_ids=[self.client1.pk, self.client2.pk])
         data = report.get_report_data()
@@ -284,6 +393,76 @@ class TestView(BaseTestData, TestCase):
         self.assertTrue(len(data), 2)
         # self.assertEqual(view_report_data['data'], data)
 
+    def test_form_class_cached(self):
+        from slick_reporting import views as slick_views
+        views.MonthlyProductSales.clear_form_class_cache()
+        with patch.object(slick_views, 'report_form_factory', wraps=slick_views.report_form_factory) as factory:
+            self.client.get(reverse('report1'))
+            self.client.get(reverse('report1'), data={'client_id': [self.client1.pk]})
+            self.assertEqual(factory.call_count, 1)
+
+            views.MonthlyProductSales.clear_form_class_cache()
+            self.client.get(reverse('report1'))
+            self.assertEqual(factory.call_count, 2)
+
+            # a per request initial is passed to the form, not cached with its class
+            for day in (1, 2):
+                initial = {'start_date': datetime.datetime(year, 1, day)}
+                with patch.object(views.MonthlyProductSales, 'get_form_initial', return_value=initial):
+                    response = self.client.get(reverse('report1'))
+                self.assertEqual(response.context['form'].initial['start_date'], initial['start_date'])
+            self.assertEqual(factory.call_count, 2)
+
+    def test_lazy_foreign_keys(self):
+        with self.assertRaises(ImproperlyConfigured):
+            report_form_factory(SimpleSales, lazy_foreign_keys=['client'])
+        lookup_key = lookup_registry.register(SimpleSales._meta.get_field('client'), search_fields=['name'])
+        self.addCleanup(lookup_registry.unregister, lookup_key)
+
+        form_class = report_form_factory(SimpleSales, lazy_foreign_keys=['client'])
+        self.assertIsInstance(form_class.base_fields['client_id'], LazyModelMultipleChoiceField)
+        self.assertNotIsInstance(form_class.base_fields['product_id'], LazyModelMultipleChoiceField)
+        lookup_url = reverse('slick_reporting_lookup', args=[lookup_key])
+
+        with self.assertNumQueries(0):
+            html = str(form_class()['client_id'])
+        self.assertIn(f'data-ajax--url="{lookup_url}"', html)
+        self.assertNotIn('<option', html)
+
+        form = form_class(data={'client_id': [self.client2.pk]})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.get_filters()[1], {'client_id__in': [self.client2.pk]})
+        html = str(form['client_id'])
+        self.assertIn(f'value="{self.client2.pk}"', html)
+        self.assertEqual(html.count('<option'), 1)
+        self.assertFalse(form_class(data={'client_id': ['x']}).is_valid())
+
+    def test_foreign_key_lookup(self):
+        lookup_key = lookup_registry.register(SimpleSales._meta.get_field('client'), search_fields=['name'])
+        self.addCleanup(lookup_registry.unregister, lookup_key)
+        lookup_url = reverse('slick_reporting_lookup', args=[lookup_key])
+
+        # an authenticated user with the view permission on the related model is required
+        self.assertEqual(self.client.get(lookup_url).status_code, 403)
+        self.client.force_login(self.limited_user)
+        self.assertEqual(self.client.get(lookup_url).status_code, 403)
+        self.client.force_login(self.user)
+
+        with patch.object(ForeignKeyLookupView, 'page_size', 2):
+            data = self.client.get(lookup_url, data={'term': 'client'}).json()
+            self.assertEqual([x['id'] for x in data['results']], [self.client1.pk, self.client2.pk])
+            self.assertTrue(data['pagination']['more'])
+            data = self.client.get(lookup_url, data={'term': 'client', 'page': 2}).json()
+            self.assertEqual([x['id'] for x in data['results']], [self.client3.pk, self.clientIdle.pk])
+            self.assertFalse(data['pagination']['more'])
+        data = self.client.get(lookup_url, data={'term': 'idle'}).json()
+        self.assertEqual(data['results'], [{'id': self.clientIdle.pk, 'text': str(self.clientIdle)}])
+        self.assertEqual(self.client.get(lookup_url, data={'page': 'x'}).status_code, 400)
+
+        # only the registered foreign keys can be looked up
+        response = self.client.get(reverse('slick_reporting_lookup', args=['tests.simplesales.product']))
+        self.assertEqual(response.status_code, 404)
+
     def test_ajax(self):
         report_generator = ReportGenerator(report_model=SimpleSales,
                                            date_field='doc_date',
@@ -298,6 +477,131 @@ class TestView(BaseTestData, TestCase):
         view_report_data = response.json()
         self.assertEqual(view_report_data['data'], data)
 
+    @override_settings(DEBUG=True)
+    def test_ajax_profile(self):
+        response = self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertNotIn('profile', response.json())
+
+        with patch.object(views.MonthlyProductSales, 'profile_report', True):
+            response = self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        profile = response.json()['profile']
+        self.assertEqual(profile['query_count'], len(profile['queries']))
+        self.assertIn('time_series', [x['window'] for x in profile['fields']])
+
+    def test_datatables_server_side(self):
+        params = {
+            'draw': '3', 'start': '0', 'length': '2',
+            'columns[0][data]': 'name', 'columns[1][data]': '__total__',
+            'order[0][column]': '1', 'order[0][dir]': 'desc',
+        }
+        response = self.client.get(reverse('server-side'), data=params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = response.json()
+        self.assertEqual(data['draw'], 3)
+        self.assertEqual(data['recordsFiltered'], 3)
+        self.assertEqual([x['name'] for x in data['data']], ['Client 3', 'Client 2'])
+
+        # -1 is all the rows
+        for extra in ({'length': '-1'}, {'length': '-1', 'order[0][column]': '2'}):
+            response = self.client.get(reverse('server-side'), data=dict(params, **extra),
+                                       HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            data = response.json()
+            self.assertEqual(len(data['data']), 3)
+            self.assertEqual((data['recordsTotal'], data['recordsFiltered']), (3, 3))
+
+        response = self.client.get(reverse('server-side'), data=dict(params, start='x'),
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+
+        # the first page is rendered, the others are requested by DataTables
+        response = self.client.get(reverse('server-side'))
+        self.assertEqual(len(response.context['report_data']['data']), 3)
+        self.assertEqual(response.context['report_data']['records_filtered'], 3)
+        self.assertContains(response, 'serverSide: true')
+
+    def test_export_csv(self):
+        expected = self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        response = self.client.get(reverse('report1'), data={'_export': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('monthlyproductsales.csv', response['Content-Disposition'])
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(lines[0], [x['verbose_name'] for x in expected['columns']])
+        self.assertEqual(len(lines), len(expected['data']) + 1)
+
+    def test_export_ndjson(self):
+        expected = self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        response = self.client.get(reverse('report1'), data={'_export': 'ndjson'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(x) for x in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, expected['data'])
+
+        response = self.client.get(reverse('report1'), data={'_export': 'pdf'})
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(find_spec('openpyxl'), 'openpyxl is not installed')
+    def test_export_xlsx(self):
+        from openpyxl import load_workbook
+        expected = self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        response = self.client.get(reverse('report1'), data={'_export': 'xlsx'})
+        self.assertTrue(response.streaming)
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual(sheet.max_row, len(expected['data']) + 1)
+
+    def test_results_cache(self):
+        caches['default'].clear()
+        result_cache = views.MonthlyProductSales.result_cache_class()
+        url = reverse('report1')
+        with patch.object(views.MonthlyProductSales, 'cache_timeout', 60):
+            data = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 0, 'misses': 1})
+
+            self.assertEqual(self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json(), data)
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 1, 'misses': 1})
+
+            # different filters are cached apart, whatever the ids order
+            self.client.get(url, data={'client_id': [self.client2.pk, self.client1.pk]},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.client.get(url, data={'client_id': [self.client1.pk, self.client2.pk]},
+                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 2, 'misses': 2})
+
+            # a queryset scoped to the request is cached apart
+            with patch.object(views.MonthlyProductSales, 'get_queryset',
+                              lambda view: SimpleSales.objects.filter(client=self.client1)):
+                scoped_data = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 2, 'misses': 3})
+            self.assertEqual([x['name'] for x in scoped_data['data']], ['Client 1'])
+
+    def test_results_cache_invalidation(self):
+        caches['default'].clear()
+        result_cache = views.MonthlyProductSales.result_cache_class()
+        track_model(SimpleSales)
+        track_model(Client)
+        url = reverse('report1')
+
+        def get_report():
+            return self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+
+        with patch.object(views.MonthlyProductSales, 'cache_timeout', 60):
+            get_report()
+            get_report()
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 1, 'misses': 1})
+
+            SimpleSales.objects.create(doc_date=datetime.datetime(year, 3, 2), client=self.client1,
+                                       product=self.product1, quantity=10, price=10)
+            self.assertEqual(get_report()['data'][0]['__total__TS%s0401' % year], 200)
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 1, 'misses': 2})
+
+            # the group by model is tracked as well
+            self.client1.name = 'Client 1 renamed'
+            self.client1.save()
+            self.assertEqual(get_report()['data'][0]['name'], 'Client 1 renamed')
+
+            # updates sending no signals
+            VersionedQuerySet(SimpleSales).filter(client=self.client1).update(value=200)
+            self.assertEqual(get_report()['data'][0]['__total__TS%s0401' % year], 400)
+            self.assertEqual(result_cache.get_stats('monthlyproductsales'), {'hits': 1, 'misses': 4})
+
     def test_crosstab_report_view(self):
         from .report_generators import ProductClientSalesMatrix
         data = ProductClientSalesMatrix(crosstab_compute_reminder=True,
@@ -343,6 +647,94 @@ class TestView(BaseTestData, TestCase):
         self.assertRaises(TypeError, test_function)
 
 
+class TestAsyncReport(BaseTransactionTestData, ReportGeneratorTestMixin, TransactionTestCase):
+
+    def get_generator_kwargs(self):
+        return dict(columns=['slug', 'name', '__fb__', '__balance__', '__total__'],
+                    start_date=datetime.datetime(year, 2, 1))
+
+    async def test_aget_report_data(self):
+        expected = await sync_to_async(lambda: self.get_generator().get_report_data())()
+        report = self.get_generator(lazy_preparation=True)
+        self.assertEqual(await report.aget_report_data(), expected)
+
+    async def test_aget_report_data_paginated_details(self):
+        kwargs = dict(group_by=None, columns=['slug', 'doc_date', 'value'], page_offset=2, page_length=3)
+        expected = await sync_to_async(lambda: self.get_generator(**kwargs).get_report_data())()
+        report = self.get_generator(lazy_preparation=True, **kwargs)
+        self.assertEqual(await report.aget_report_data(), expected)
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(report.records_filtered, 6)
+
+    async def test_async_view(self):
+        response = await self.async_client.get(reverse('report1-async'))
+        self.assertEqual(response.status_code, 200)
+        data = response.context['report_data']['data']
+        self.assertEqual(len(data), 3)
+
+        expected = await sync_to_async(
+            lambda: self.client.get(reverse('report1'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json())()
+        self.assertEqual([x['__total__TS%s0301' % year] for x in data],
+                         [x['__total__TS%s0301' % year] for x in expected['data']])
+
+    async def test_async_view_cached(self):
+        caches['default'].clear()
+        result_cache = views.MonthlyProductSalesAsync.result_cache_class()
+        url = reverse('report1-async')
+        # the async client takes the headers as is
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        with patch.object(views.MonthlyProductSalesAsync, 'cache_timeout', 60):
+            data = (await self.async_client.get(url, **headers)).json()
+            self.assertEqual(len(data['data']), 3)
+            self.assertEqual((await self.async_client.get(url, **headers)).json(), data)
+            self.assertEqual(result_cache.get_stats('monthlyproductsalesasync'), {'hits': 1, 'misses': 1})
+
+    async def test_async_view_export(self):
+        response = await self.async_client.get(reverse('report1-async'), {'_export': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('monthlyproductsalesasync.csv', response['Content-Disposition'])
+        # iterated in the event loop, like the ASGI handler does
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(lines), 4)
+
+    async def test_async_view_filtered(self):
+        response = await self.async_client.get(reverse('report1-async'), {'client_id': [self.clients[1].pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([x['name'] for x in response.context['report_data']['data']], ['Client 1'])
+
+
+class TestReportResultCache(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_concurrent_computation_done_once(self):
+        result_cache = ReportResultCache(timeout=60)
+        key = result_cache.get_key('report', {})
+        computations = []
+
+        def compute():
+            computations.append(1)
+            return {'data': [1]}
+
+        # another request holds the lock, and caches the results in a while
+        caches['default'].add(f'{key}:lock', 'token')
+        timer = threading.Timer(0.2, lambda: result_cache.set(key, {'data': [2]}))
+        timer.start()
+        self.assertEqual(result_cache.get_or_compute('report', {}, compute), {'data': [2]})
+        timer.join()
+        self.assertEqual(computations, [])
+
+    def test_computed_locally_on_wait_timeout(self):
+        result_cache = ReportResultCache(timeout=60)
+        result_cache.wait_timeout = 0.2
+        key = result_cache.get_key('report', {})
+        caches['default'].add(f'{key}:lock', 'token')
+        self.assertEqual(result_cache.get_or_compute('report', {}, lambda: {'data': [1]}), {'data': [1]})
+        self.assertEqual(result_cache.get_or_compute('report', {}, lambda: {'data': [3]}), {'data': [1]})
+        self.assertEqual(result_cache.get_stats('report'), {'hits': 1, 'misses': 1})
+
+
 class TestReportFieldRegistry(TestCase):
     def test_unregister(self):
         # unregister a field that we know exists
@@ -490,6 +882,26 @@ class TestGroupByFlag(TestCase):
         self.assertEqual(data[0]['sum__quantity'], 180)
         self.assertEqual(data[1]['sum__quantity'], 25)
 
+    def test_single_query_debit_credit(self):
+        from django.db.models import Q
+        from slick_reporting.fields import TotalReportField
+
+        class SingleQueryTotal(TotalReportField):
+            single_query_debit_credit = True
+
+        kwargs = dict(plus_side_q=[Q(flag='sales')], minus_side_q=[Q(flag='sales-return')],
+                      report_model=SalesWithFlag, date_field='doc_date', group_by='client')
+        field = TotalReportField(**kwargs)
+        field.init_preparation(None, {})
+        single_query_field = SingleQueryTotal(**kwargs)
+        with self.assertNumQueries(1):
+            single_query_field.prepare(None, {})
+        single_query_field.init_preparation(None, {})
+
+        for client in [self.client1, self.client2, self.client3, self.clientIdle]:
+            self.assertEqual(single_query_field.resolve(str(client.pk)), field.resolve(str(client.pk)))
+        self.assertEqual(single_query_field.resolve(str(self.client3.pk)), 650)
+
     def test_group_by_flag_time_series(self):
         report = GroupByCharFieldPlusTimeSeries()
         data = report.get_report_data()
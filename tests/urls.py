@@ -1,9 +1,12 @@
-from django.urls import path
+from django.urls import include, path
 from . import views
 urlpatterns = [
     path('report1/', views.MonthlyProductSales.as_view(), name='report1'),
+    path('report1-async/', views.MonthlyProductSalesAsync.as_view(), name='report1-async'),
+    path('server-side/', views.ClientTotalsServerSide.as_view(), name='server-side'),
     path('product_crosstab_client/', views.ProductClientSalesMatrix.as_view(), name='product_crosstab_client'),
     path('crosstab-columns-on-fly/', views.CrossTabColumnOnFly.as_view(), name='crosstab-columns-on-fly'),
+    path('slick_reporting/', include('slick_reporting.urls')),
     path('queryset-only/', views.MonthlyProductSalesWQS.as_view(), name='queryset-only'),
 ]
 
@@ -1,4 +1,4 @@
-from slick_reporting.views import SlickReportView
+from slick_reporting.views import SlickReportView, AsyncSlickReportView
 from slick_reporting.fields import SlickReportField, TotalReportField
 from django.db.models import Sum, Count
 from .models import SimpleSales, ComplexSales
@@ -14,6 +14,15 @@ class MonthlyProductSales(SlickReportView):
     time_series_columns = ['__total__', '__balance__']
 
 
+class MonthlyProductSalesAsync(AsyncSlickReportView):
+    report_model = SimpleSales
+    date_field = 'doc_date'
+    group_by = 'client'
+    columns = ['slug', 'name', '__fb__']
+    time_series_pattern = 'monthly'
+    time_series_columns = ['__total__', '__balance__']
+
+
 class ProductClientSalesMatrix(SlickReportView):
     report_title = 'awesome report title'
     report_model = SimpleSales
@@ -77,3 +86,11 @@ class TaxSales(SlickReportView):
             'title_source': 'tax__name',
         }
     ]
+
+
+class ClientTotalsServerSide(SlickReportView):
+    report_model = SimpleSales
+    date_field = 'doc_date'
+    group_by = 'client'
+    columns = ['name', '__total__']
+    datatables_server_side = True